@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Transaction, USDAccount
+from .models import UserProfile, Transaction, USDAccount, Posting, BalanceSnapshot
 
 
 @admin.register(UserProfile)
@@ -20,3 +20,14 @@ class TransactionAdmin(admin.ModelAdmin):
 class USDAccountAdmin(admin.ModelAdmin):
     list_display = ('user', 'balance', 'created_at')
     search_fields = ('user__username',)
+
+
+@admin.register(Posting)
+class PostingAdmin(admin.ModelAdmin):
+    list_display = ('transaction', 'account', 'side', 'amount', 'created_at')
+    list_filter = ('side',)
+
+
+@admin.register(BalanceSnapshot)
+class BalanceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('account', 'balance', 'posting_id', 'created_at')
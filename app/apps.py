@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_save, post_delete
+        from .balance_cache import account_changed, check_backend
+        from .models import USDAccount
+
+        post_save.connect(account_changed, sender=USDAccount, dispatch_uid='balance_cache_save')
+        post_delete.connect(account_changed, sender=USDAccount, dispatch_uid='balance_cache_delete')
+        checks.register(check_backend, checks.Tags.caches)
+
+        from . import metrics
+        connection_created.connect(metrics.install_db_hooks, dispatch_uid='metrics_db_hooks')
+
+        from . import providers
+        providers.warm_up()
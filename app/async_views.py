@@ -0,0 +1,107 @@
+"""
+Async (ASGI) versions of the anchor-bound endpoints.
+
+These are plain Django ``async def`` views, since DRF views are synchronous.
+Database work still runs through ``sync_to_async``; the anchor round trip in
+``transaction_status`` is awaited on the shared async HTTP client, so a
+single worker can keep many slow anchor calls in flight at once.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from knox.auth import TokenAuthentication
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import idempotency
+from .models import Transaction
+from .payment_factory import PaymentFactory
+from .transact import DepositService, WithdrawalService
+
+logger = logging.getLogger(__name__)
+
+
+@csrf_exempt
+@require_POST
+async def initiate_deposit(request):
+    return await _initiate(request, 'initiate_deposit', DepositService().initiate_deposit)
+
+
+@csrf_exempt
+@require_POST
+async def initiate_withdrawal(request):
+    return await _initiate(request, 'initiate_withdrawal', WithdrawalService().initiate_withdrawal)
+
+
+@require_GET
+async def transaction_status(request, transaction_id):
+    user, error = await _authenticate(request)
+    if error is not None:
+        return error
+
+    logger.info(f"Checking status for transaction {transaction_id}")
+    region = await sync_to_async(lambda: user.userprofile.region)()
+    provider = await (Transaction.objects.filter(user=user, external_transaction_id=transaction_id)
+                      .values_list('provider', flat=True).afirst())
+    payment_service = PaymentFactory.get_status_service(region, provider)
+    if payment_service is None:
+        return _json({"error": "Status is not available for this transaction."}, status.HTTP_404_NOT_FOUND)
+    status_response = await payment_service.acheck_transaction_status(transaction_id)
+
+    if status_response.get("status") == "success":
+        return _json(status_response, status.HTTP_200_OK)
+
+    return _json({"error": "Transaction not found or failed."}, status.HTTP_404_NOT_FOUND)
+
+
+async def _initiate(request, endpoint, initiate):
+    user, error = await _authenticate(request)
+    if error is not None:
+        return error
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return _json({'error': 'Request body must be JSON'}, status.HTTP_400_BAD_REQUEST)
+    if not isinstance(data, dict):
+        return _json({'error': 'Request body must be a JSON object'}, status.HTTP_400_BAD_REQUEST)
+
+    def run():
+        amount = data.get('amount')
+        if not amount:
+            return status.HTTP_400_BAD_REQUEST, {'error': 'Amount is required'}
+        result = initiate(user, amount)
+        if 'error' in result:
+            return status.HTTP_400_BAD_REQUEST, result
+        return status.HTTP_200_OK, result
+
+    # Same endpoint names as the DRF views, so a key is honoured across both paths.
+    key = request.headers.get(idempotency.HEADER)
+    if key:
+        status_code, body, replayed = await sync_to_async(idempotency.execute)(user, endpoint, key, data, run)
+    else:
+        (status_code, body), replayed = await sync_to_async(run)(), False
+
+    response = _json(body, status_code)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+async def _authenticate(request):
+    try:
+        credentials = await sync_to_async(TokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as exc:
+        return None, _json({'detail': str(exc.detail)}, status.HTTP_401_UNAUTHORIZED)
+    if credentials is None:
+        return None, _json({'detail': 'Authentication credentials were not provided.'},
+                           status.HTTP_401_UNAUTHORIZED)
+    return credentials[0], None
+
+
+def _json(body, status_code):
+    return JsonResponse(body, status=status_code, encoder=DjangoJSONEncoder, safe=False)
@@ -0,0 +1,162 @@
+"""
+Read-through/write-through cache of account balances.
+
+Each account has a generation counter in the shared cache backend that is
+bumped after every committed balance change. Cached balances are tagged
+with the generation that was current *before* the database read that
+produced them, and are only served while that generation is still
+current, so once a write has committed no earlier value can be returned.
+
+A small in-process LRU sits in front of the shared backend; it still
+checks the shared generation on every read, so it only saves fetching and
+unpickling the value, never freshness.
+
+The backend must be shared by every process that changes balances, or a
+worker's credit never invalidates a web process's entry. ``check_backend``
+is a system check that refuses a process-local backend unless
+``BALANCE_CACHE_SINGLE_PROCESS`` is set.
+"""
+import random
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction as db_transaction
+
+from .models import USDAccount
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class BalanceCache:
+    def __init__(self, lru_size=None):
+        if lru_size is None:
+            lru_size = getattr(settings, 'BALANCE_CACHE_LRU_SIZE', 10000)
+        self._local = LRUCache(lru_size)
+
+    @property
+    def backend(self):
+        return caches[getattr(settings, 'BALANCE_CACHE_ALIAS', 'default')]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'BALANCE_CACHE_TIMEOUT', 300)
+
+    def get(self, user_id):
+        """Return the balance for ``user_id``, raising ``USDAccount.DoesNotExist``."""
+        generation = self.backend.get(self._generation_key(user_id))
+        if generation is None:
+            generation = self._start_generation(user_id)
+        else:
+            entry = self._local.get(user_id)
+            if entry is None or entry[0] != generation:
+                entry = self.backend.get(self._value_key(user_id))
+            if entry is not None and entry[0] == generation:
+                self._local.set(user_id, entry)
+                return entry[1]
+        return self._fill(user_id, generation)
+
+    def written(self, user_id):
+        """Record a committed balance change and cache the new value."""
+        try:
+            generation = self.backend.incr(self._generation_key(user_id))
+        except ValueError:
+            generation = self._start_generation(user_id)
+        self._local.delete(user_id)
+        try:
+            self._fill(user_id, generation)
+        except USDAccount.DoesNotExist:
+            pass
+
+    def on_commit(self, user_id):
+        """Schedule ``written()`` for when the current transaction commits."""
+        db_transaction.on_commit(lambda: self.written(user_id))
+
+    def clear(self):
+        self._local.clear()
+
+    def _fill(self, user_id, generation):
+        # ``generation`` must have been read before this query: if a write
+        # commits in between, it bumps the generation and the entry stored
+        # here is never served.
+        balance = USDAccount.objects.balance_of(user_id)
+        entry = (generation, balance)
+        self.backend.set(self._value_key(user_id), entry, self.timeout)
+        self._local.set(user_id, entry)
+        return balance
+
+    def _start_generation(self, user_id):
+        # Random starting points keep a generation recreated after eviction
+        # from matching an entry cached before it.
+        self.backend.add(self._generation_key(user_id), random.getrandbits(62), None)
+        return self.backend.get(self._generation_key(user_id))
+
+    @staticmethod
+    def _generation_key(user_id):
+        return f'balance:gen:{user_id}'
+
+    @staticmethod
+    def _value_key(user_id):
+        return f'balance:value:{user_id}'
+
+
+balance_cache = BalanceCache()
+
+
+def check_backend(app_configs=None, **kwargs):
+    if getattr(settings, 'BALANCE_CACHE_SINGLE_PROCESS', False):
+        return []
+    if not isinstance(balance_cache.backend, LocMemCache):
+        return []
+    return [checks.Error(
+        f"The balance cache ({getattr(settings, 'BALANCE_CACHE_ALIAS', 'default')!r}) is process-local, so "
+        "balance changes made by other processes never invalidate it.",
+        hint="Set BALANCE_CACHE_URL to a Redis or Memcached server shared by all processes, or "
+             "BALANCE_CACHE_SINGLE_PROCESS = True if one process runs everything.",
+        id='app.E001',
+    )]
+
+
+def account_changed(sender, instance, **kwargs):
+    """Catch balance writes that bypass the manager, e.g. admin edits."""
+    balance_cache.on_commit(instance.user_id)
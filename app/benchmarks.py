@@ -0,0 +1,214 @@
+"""
+Micro-benchmarks for the core money paths.
+
+Each benchmark times one operation in isolation, serially, against a
+database seeded with ``size`` transactions spread over a population of
+funded, verified users:
+
+* ``account_deposit`` / ``account_withdraw``: ``USDAccount.deposit`` and
+  ``USDAccount.withdraw``;
+* ``internal_transfer``: ``TransferService.process_internal_transfer``;
+* ``deposit_callback``: ``DepositService.process_deposit_callback`` on a
+  fresh pending deposit;
+* ``transaction_view``: the first page of ``transaction_view``, rendered
+  to JSON.
+
+``run()`` grows the dataset through the requested sizes in ascending order
+and returns a JSON-serializable report; ``compare()`` lists regressions in
+throughput or p99 latency against an earlier report. Both work on whatever
+database is current, so run them through ``manage.py benchmark``, which
+uses a throwaway test database.
+"""
+import platform
+import time
+import uuid
+from decimal import Decimal
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction as db_transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .loadtest import summarize
+from .models import User, UserProfile, USDAccount, Transaction
+from .transact import DepositService, TransferService
+from .views import transaction_view
+
+SEED_BATCH_SIZE = 5000
+OPENING_BALANCE = Decimal('1000000000.00')
+AMOUNT = Decimal('1.00')
+
+
+class Context:
+    """The seeded users the benchmarks operate on."""
+
+    def __init__(self, users):
+        self.users = users
+        self.subject = users[0]
+        self.account = USDAccount.objects.get(user=self.subject)
+        self.counterparty = users[1]
+        self.factory = APIRequestFactory()
+
+
+def _account_deposit(context):
+    return None, lambda: context.account.deposit(AMOUNT)
+
+
+def _account_withdraw(context):
+    return None, lambda: context.account.withdraw(AMOUNT)
+
+
+def _internal_transfer(context):
+    service = TransferService()
+    return None, lambda: service.process_internal_transfer(context.subject, context.counterparty, str(AMOUNT))
+
+
+def _deposit_callback(context):
+    def setup():
+        external_id = str(uuid.uuid4())
+        Transaction.objects.create(user=context.subject, transaction_type='deposit', amount=AMOUNT,
+                                   status='pending', external_transaction_id=external_id)
+        return {'transaction_id': external_id, 'status': 'completed'}
+
+    return setup, lambda callback_data: DepositService.process_deposit_callback(callback_data)
+
+
+def _transaction_view(context):
+    def setup():
+        # Keep the user throttle out of the measurement.
+        cache.clear()
+        request = context.factory.get('/api/transactions/', {'page_size': 50})
+        force_authenticate(request, user=context.subject)
+        return request
+
+    return setup, lambda request: transaction_view(request).render()
+
+
+BENCHMARKS = {
+    'account_deposit': _account_deposit,
+    'account_withdraw': _account_withdraw,
+    'internal_transfer': _internal_transfer,
+    'deposit_callback': _deposit_callback,
+    'transaction_view': _transaction_view,
+}
+
+
+def parse_names(spec):
+    """``'account_deposit,transaction_view'`` -> list of benchmark names; empty means all."""
+    names = [name for name in (spec or '').split(',') if name] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark: {', '.join(unknown)}")
+    return names
+
+
+def seed_users(count, prefix='bench'):
+    """Create (or reuse) ``count`` verified users with large balances, in order."""
+    usernames = [f"{prefix}-{index}" for index in range(count)]
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    missing = [username for username in usernames if username not in existing]
+    if missing:
+        password = make_password(None)
+        with db_transaction.atomic():
+            User.objects.bulk_create([User(username=username, email=f"{username}@example.com", password=password)
+                                      for username in missing], batch_size=SEED_BATCH_SIZE)
+            created = list(User.objects.filter(username__in=missing))
+            UserProfile.objects.bulk_create([UserProfile(user=user, kyc_status='approved', region='US')
+                                             for user in created], batch_size=SEED_BATCH_SIZE)
+            USDAccount.objects.bulk_create([USDAccount(user=user, balance=OPENING_BALANCE)
+                                            for user in created], batch_size=SEED_BATCH_SIZE)
+    users = {user.username: user for user in User.objects.filter(username__in=usernames)
+             .select_related('userprofile')}
+    return [users[username] for username in usernames]
+
+
+def seed_transactions(users, size):
+    """Insert completed transactions, round-robin over ``users``, until the table holds ``size`` rows."""
+    missing = size - Transaction.objects.count()
+    types = [choice for choice, _ in Transaction.TRANSACTION_TYPE_CHOICES]
+    offset = 0
+    while missing > 0:
+        batch = min(missing, SEED_BATCH_SIZE)
+        Transaction.objects.bulk_create([
+            Transaction(user=users[(offset + index) % len(users)], transaction_type=types[index % len(types)],
+                        amount=AMOUNT, status='completed')
+            for index in range(batch)
+        ])
+        offset += batch
+        missing -= batch
+
+
+def measure(setup, operation, iterations, warmup):
+    """Latencies in seconds of ``iterations`` calls to ``operation``, after ``warmup`` untimed ones."""
+    latencies = []
+    for index in range(warmup + iterations):
+        args = () if setup is None else (setup(),)
+        began = time.perf_counter()
+        operation(*args)
+        latency = time.perf_counter() - began
+        if index >= warmup:
+            latencies.append(latency)
+    return latencies
+
+
+def run(sizes, iterations=200, warmup=20, names=None, users=1000, progress=None):
+    """
+    Benchmark ``names`` (default: all) at each dataset size.
+    Returns ``{'meta': {...}, 'results': [{'benchmark', 'size', 'vendor', ...summary}]}``.
+    """
+    names = names or list(BENCHMARKS)
+    population = seed_users(max(2, users))
+    report = {'meta': environment(iterations, warmup, users), 'results': []}
+    for size in sorted(sizes):
+        seed_transactions(population, size)
+        context = Context(population)
+        for name in names:
+            setup, operation = BENCHMARKS[name](context)
+            latencies = measure(setup, operation, iterations, warmup)
+            result = {'benchmark': name, 'size': size, 'vendor': connection.vendor,
+                      **summarize(latencies, sum(latencies))}
+            report['results'].append(result)
+            if progress:
+                progress(result)
+    return report
+
+
+def environment(iterations, warmup, users):
+    return {
+        'created_at': timezone.now().isoformat(),
+        'vendor': connection.vendor,
+        'database_version': '.'.join(map(str, connection.get_database_version())),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'iterations': iterations,
+        'warmup': warmup,
+        'users': users,
+    }
+
+
+def compare(baseline, current, max_throughput_drop=0.10, max_p99_increase=0.20):
+    """
+    Regressions of ``current`` against ``baseline``, as readable strings.
+
+    Results are matched on benchmark, dataset size and database vendor;
+    ones present in only one report are skipped. A result regresses when
+    its throughput fell by more than ``max_throughput_drop`` or its p99
+    latency rose by more than ``max_p99_increase`` (both fractions).
+    """
+    def key(result):
+        return result['benchmark'], result['size'], result['vendor']
+
+    before = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        label = f"{result['benchmark']} @ {result['size']} rows ({result['vendor']})"
+        if old['throughput'] and (old['throughput'] - result['throughput']) / old['throughput'] > max_throughput_drop:
+            regressions.append(f"{label}: throughput {old['throughput']:.1f} -> {result['throughput']:.1f} ops/s")
+        if old['p99_ms'] and (result['p99_ms'] - old['p99_ms']) / old['p99_ms'] > max_p99_increase:
+            regressions.append(f"{label}: p99 {old['p99_ms']:.2f} -> {result['p99_ms']:.2f} ms")
+    return regressions
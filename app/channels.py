@@ -0,0 +1,129 @@
+"""
+Sequence numbers and channel accounts for payouts from the platform account.
+
+Every Stellar transaction consumes the next sequence number of its source
+account, and transactions from one source have to arrive in order. Rather
+than loading the account from Horizon before every payment,
+``SequenceNumbers`` caches each account's sequence number and hands out the
+next one locally, reloading only after a submission that may not have
+consumed it (``tx_bad_seq``, timeouts and other rejections).
+
+``ChannelPool`` lends out channel accounts (``STELLAR_CHANNEL_SECRETS``).
+A payout uses a channel as the transaction source, so the channel pays the
+fee and supplies the sequence number, while the payment operation itself
+comes from the platform account. Each channel carries one payout at a time,
+so with N channels N payouts can be in flight at once. Without channels the
+platform account is the only entry and payouts are serialised through it.
+"""
+import queue
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from stellar_sdk import Account, Keypair
+from stellar_sdk.exceptions import BaseHorizonError
+
+# Result codes for transactions that made it into a ledger, and so used up
+# their sequence number even though they failed.
+CONSUMED_RESULT_CODES = {'tx_failed'}
+
+
+class ChannelUnavailable(Exception):
+    pass
+
+
+class SequenceNumbers:
+    def __init__(self):
+        self._sequences = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, server, account_id):
+        """An ``Account`` to build the next transaction from ``account_id`` with."""
+        with self._lock_for(account_id):
+            sequence = self._sequences.get(account_id)
+            if sequence is None:
+                sequence = server.load_account(account_id).sequence
+            # TransactionBuilder uses sequence + 1, so the next reservation starts there.
+            self._sequences[account_id] = sequence + 1
+            return Account(account_id, sequence)
+
+    def invalidate(self, account_id):
+        """Forget ``account_id``'s sequence number; the next reservation reloads it."""
+        with self._lock_for(account_id):
+            self._sequences.pop(account_id, None)
+
+    def _lock_for(self, account_id):
+        lock = self._locks.get(account_id)
+        if lock is None:
+            with self._lock:
+                lock = self._locks.setdefault(account_id, threading.Lock())
+        return lock
+
+
+class ChannelPool:
+    def __init__(self, keypairs):
+        self.size = len(keypairs)
+        self._idle = queue.Queue()
+        for keypair in keypairs:
+            self._idle.put(keypair)
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow a channel keypair for the duration of the ``with`` block."""
+        try:
+            channel = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise ChannelUnavailable(f"No channel account free within {timeout}s")
+        try:
+            yield channel
+        finally:
+            self._idle.put(channel)
+
+
+def sequence_consumed(error):
+    """Whether a failed submission still used up its sequence number."""
+    if not isinstance(error, BaseHorizonError):
+        # Timeouts and connection errors leave it unknown.
+        return False
+    return result_code(error) in CONSUMED_RESULT_CODES
+
+
+def result_code(error):
+    extras = getattr(error, 'extras', None) or {}
+    return extras.get('result_codes', {}).get('transaction')
+
+
+sequence_numbers = SequenceNumbers()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def channel_pool(platform_keypair):
+    """The process-wide channel pool for payouts from ``platform_keypair``."""
+    pool = _pools.get(platform_keypair.public_key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(platform_keypair.public_key)
+            if pool is None:
+                secrets = getattr(settings, 'STELLAR_CHANNEL_SECRETS', [])
+                keypairs = [Keypair.from_secret(secret) for secret in secrets] or [platform_keypair]
+                pool = _pools[platform_keypair.public_key] = ChannelPool(keypairs)
+    return pool
+
+
+def reset():
+    global sequence_numbers
+    with _pools_lock:
+        _pools.clear()
+    sequence_numbers = SequenceNumbers()
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('STELLAR_CHANNEL_SECRETS', 'STELLAR_PLATFORM_SECRET'):
+        reset()
+
+
+setting_changed.connect(_reset_on_setting_change)
@@ -1,8 +1,9 @@
-import requests
 from django.conf import settings
 import logging
 from rest_framework.templatetags.rest_framework import data
 
+from .transport import session_for
+
 logger = logging.getLogger(__name__)
 
 ...
@@ -13,6 +14,7 @@ class CircleClient:
     def __init__(self):
         self.api_key = settings.CIRCLE_API_KEY
         self.api_url = settings.CIRCLE_API_URL
+        self.http = session_for('circle')
 
     def create_payment(self, amount, currency, recipient):
         url = f"{self.api_url}payments"
@@ -25,7 +27,7 @@ class CircleClient:
             'currency': currency,
             'recipient': recipient
         }
-        response = requests.post(url, headers=headers, json=data)
+        response = self.http.post(url, headers=headers, json=data)
 
         if response.status_code != 200:
             logger.error(f"Failed to create payment: {response.json()}")
@@ -38,7 +40,7 @@ class CircleClient:
         headers = {
             'Authorization': f'Bearer {self.api_key}'
         }
-        response = requests.get(url, headers=headers)
+        response = self.http.get(url, headers=headers)
         return response.json()
 
     def issue_usdc(self, amount, currency):
@@ -63,7 +65,7 @@ class CircleClient:
             'type': 'usdc'  # Assuming this is how to specify USDC
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        response = self.http.post(url, headers=headers, json=data)
 
         if response.status_code != 200:
             raise Exception(f"Error issuing USDC: {response.json()}")
@@ -90,7 +92,7 @@ class CircleClient:
             'currency': 'USD'  # Assuming you want to redeem to USD
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        response = self.http.post(url, headers=headers, json=data)
 
         if response.status_code != 200:
             raise Exception(f"Error redeeming USDC: {response.json()}")
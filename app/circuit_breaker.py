@@ -0,0 +1,149 @@
+"""
+Per-provider circuit breakers.
+
+Each breaker keeps the outcome and latency of the last ``window`` calls to
+its provider. Once at least ``min_calls`` are recorded and the share of
+failures or of calls slower than ``slow_call_seconds`` crosses its
+threshold, the breaker opens and calls fail fast for ``open_seconds``.
+After that one trial call is let through (half-open): success closes the
+breaker, failure opens it again.
+
+Thresholds come from ``CIRCUIT_BREAKERS`` in settings, layered over its
+``'default'`` entry and then ``DEFAULTS`` below, like ``HTTP_TRANSPORT``.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULTS = {
+    'window': 50,
+    'min_calls': 10,
+    'failure_rate': 0.5,
+    'slow_call_seconds': 5.0,
+    'slow_call_rate': 0.8,
+    'open_seconds': 30.0,
+}
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+class CircuitBreaker:
+    def __init__(self, name, window, min_calls, failure_rate, slow_call_seconds, slow_call_rate, open_seconds):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self._calls = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def allow(self):
+        """Whether a call may go ahead now; claims the trial slot when half-open."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def available(self):
+        """Like ``allow()``, but without claiming anything; used for routing."""
+        with self._lock:
+            state = self._current_state()
+            return state == CLOSED or (state == HALF_OPEN and not self._trial_in_flight)
+
+    def release(self):
+        """Give back the trial slot claimed by ``allow()`` for a call that ended without an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, ok, seconds):
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN:
+                # A call that started before the breaker tripped.
+                return
+            if state == HALF_OPEN:
+                self._trial_in_flight = False
+                if ok and seconds < self.slow_call_seconds:
+                    self._state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._trip()
+                return
+            self._calls.append((ok, seconds))
+            if len(self._calls) >= self.min_calls and self._unhealthy():
+                self._trip()
+
+    def snapshot(self):
+        with self._lock:
+            calls = len(self._calls)
+            failures = sum(1 for ok, _ in self._calls if not ok)
+            slow = sum(1 for _, seconds in self._calls if seconds >= self.slow_call_seconds)
+            latency = sum(seconds for _, seconds in self._calls) / calls if calls else 0.0
+            return {'state': self._current_state(), 'calls': calls, 'failures': failures,
+                    'slow_calls': slow, 'mean_latency': latency}
+
+    def _unhealthy(self):
+        calls = len(self._calls)
+        failures = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for _, seconds in self._calls if seconds >= self.slow_call_seconds)
+        return failures / calls >= self.failure_rate or slow / calls >= self.slow_call_rate
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+        return self._state
+
+
+def breaker_config(name):
+    configured = getattr(settings, 'CIRCUIT_BREAKERS', {})
+    return {**DEFAULTS, **configured.get('default', {}), **configured.get(name, {})}
+
+
+def breaker_for(name):
+    """Return the shared breaker for provider ``name``, creating it on first use."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name, **breaker_config(name))
+    return breaker
+
+
+def reset_all():
+    with _lock:
+        _breakers.clear()
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting == 'CIRCUIT_BREAKERS':
+        reset_all()
+
+
+setting_changed.connect(_reset_on_setting_change)
@@ -0,0 +1,165 @@
+"""
+Fee engine for deposits, withdrawals and transfers.
+
+``FEE_SCHEDULES`` in settings maps a region code (``UserProfile.region``)
+to operations, and each operation to a list of tiers. A tier covers amounts
+up to and including ``up_to`` (``None`` for the last, open-ended tier) and
+charges ``percent`` of the whole amount plus ``fixed``, optionally clamped
+to ``minimum``/``maximum``. Regions fall back to the ``'default'`` entry
+one operation at a time; an operation with no schedule is free.
+
+The schedules are compiled once into sorted tier bounds per (region,
+operation) and looked up by bisection. All arithmetic is in ``Decimal``:
+fees are rounded half-up to the cent and never exceed the amount.
+"""
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+
+DEPOSIT = 'deposit'
+WITHDRAWAL = 'withdrawal'
+TRANSFER = 'transfer'
+OPERATIONS = (DEPOSIT, WITHDRAWAL, TRANSFER)
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+@dataclass(frozen=True)
+class Tier:
+    up_to: Decimal | None
+    rate: Decimal
+    fixed: Decimal
+    minimum: Decimal
+    maximum: Decimal | None
+
+    def fee(self, amount):
+        fee = amount * self.rate + self.fixed
+        fee = max(fee, self.minimum)
+        if self.maximum is not None:
+            fee = min(fee, self.maximum)
+        return min(fee.quantize(CENT, rounding=ROUND_HALF_UP), amount)
+
+
+@dataclass(frozen=True)
+class Quote:
+    amount: Decimal
+    fee: Decimal
+
+    @property
+    def net_amount(self):
+        return self.amount - self.fee
+
+
+class Schedule:
+    """Compiled tiers for one region and operation."""
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        # Bounds of every tier but the open-ended last one.
+        self.bounds = [tier.up_to for tier in tiers[:-1]]
+
+    def tier(self, amount):
+        return self.tiers[bisect_left(self.bounds, amount)]
+
+    def fee(self, amount):
+        return self.tier(amount).fee(amount)
+
+
+FREE = Schedule([Tier(None, Decimal('0'), ZERO, ZERO, None)])
+
+
+def compile_schedules(config):
+    """``{(region, operation): Schedule}`` for a ``FEE_SCHEDULES`` setting."""
+    compiled = {}
+    for region, operations in config.items():
+        for operation, tiers in operations.items():
+            if operation not in OPERATIONS:
+                raise ImproperlyConfigured(f"FEE_SCHEDULES[{region!r}] has unknown operation {operation!r}")
+            compiled[region, operation] = _compile_tiers(region, operation, tiers)
+    return compiled
+
+
+def _compile_tiers(region, operation, tiers):
+    where = f"FEE_SCHEDULES[{region!r}][{operation!r}]"
+    if not tiers:
+        raise ImproperlyConfigured(f"{where} has no tiers")
+    compiled = []
+    for index, tier in enumerate(tiers):
+        up_to = _decimal(tier.get('up_to'), where)
+        last = index == len(tiers) - 1
+        if (up_to is None) != last:
+            raise ImproperlyConfigured(f"{where}: only the last tier is open-ended (up_to=None)")
+        if compiled and up_to is not None and up_to <= compiled[-1].up_to:
+            raise ImproperlyConfigured(f"{where}: tiers must be in ascending up_to order")
+        compiled.append(Tier(
+            up_to=up_to,
+            rate=_decimal(tier.get('percent', 0), where) / 100,
+            fixed=_decimal(tier.get('fixed', 0), where),
+            minimum=_decimal(tier.get('minimum', 0), where),
+            maximum=_decimal(tier.get('maximum'), where),
+        ))
+    return Schedule(compiled)
+
+
+def _decimal(value, where):
+    if value is None:
+        return None
+    try:
+        # Via str() so floats in settings do not bring binary rounding errors along.
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ImproperlyConfigured(f"{where}: {value!r} is not a number")
+
+
+_schedules = None
+_lock = threading.Lock()
+
+
+def schedules():
+    global _schedules
+    if _schedules is None:
+        with _lock:
+            if _schedules is None:
+                _schedules = compile_schedules(getattr(settings, 'FEE_SCHEDULES', {}))
+    return _schedules
+
+
+def schedule_for(operation, region=None):
+    compiled = schedules()
+    return compiled.get((region, operation)) or compiled.get(('default', operation)) or FREE
+
+
+def region_of(user):
+    profile = getattr(user, 'userprofile', None)
+    return profile.region if profile is not None else None
+
+
+def quote(operation, amount, region=None):
+    """The fee for one ``Decimal`` amount; ``net_amount`` is what is left after it."""
+    return Quote(amount, schedule_for(operation, region).fee(amount))
+
+
+def quote_many(operation, amounts, region=None):
+    """``quote()`` for many amounts at once, sharing one schedule lookup; returns quotes in order."""
+    schedule = schedule_for(operation, region)
+    return [Quote(amount, schedule.fee(amount)) for amount in amounts]
+
+
+def reset():
+    global _schedules
+    with _lock:
+        _schedules = None
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting == 'FEE_SCHEDULES':
+        reset()
+
+
+setting_changed.connect(_reset_on_setting_change)
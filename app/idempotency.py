@@ -0,0 +1,154 @@
+"""
+``Idempotency-Key`` support for money-moving endpoints.
+
+The first request with a given key reserves it, runs the view and stores
+the response; retries with the same key get the stored response back from
+one indexed lookup, without reaching the anchor or touching balances.
+
+A reservation whose request has not finished within
+``IDEMPOTENCY_LOCK_TIMEOUT`` is treated as abandoned (its worker crashed)
+and the next retry takes it over. The view runs in one database
+transaction with the write of its response, holding a lock on the key
+row, so a takeover waits for a slow request to finish instead of racing
+it; if the reservation was taken over anyway, the slow request's changes
+are rolled back and only the new holder's run counts.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class _LostReservation(Exception):
+    pass
+
+
+def idempotent(view):
+    """Decorate a DRF function view, below ``@api_view``/``@permission_classes``."""
+    endpoint = view.__name__
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+
+        responses = []
+
+        def run():
+            response = view(request, *args, **kwargs)
+            responses.append(response)
+            return response.status_code, getattr(response, 'data', None)
+
+        status_code, body, replayed = execute(request.user, endpoint, key, request.data, run)
+        if responses:
+            return responses[0]
+        response = Response(body, status=status_code)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+    return wrapper
+
+
+def execute(user, endpoint, key, data, run):
+    """
+    Run ``run()`` at most once per ``(user, endpoint, key)``.
+
+    ``run`` returns ``(status_code, body)``. Returns ``(status_code, body,
+    replayed)``, where ``replayed`` is true when the stored response of an
+    earlier request is being returned instead.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        return (status.HTTP_400_BAD_REQUEST,
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'}, False)
+
+    request_hash = _fingerprint(data)
+    record = _reserve(user, endpoint, key, request_hash)
+    if record.request_hash != request_hash:
+        return (status.HTTP_422_UNPROCESSABLE_ENTITY,
+                {'error': f'{HEADER} was already used for a different request'}, False)
+    if record.response_status is not None:
+        return record.response_status, record.response_body, True
+    if not getattr(record, 'reserved', False):
+        return _in_progress()
+
+    # Only touch the reservation while we still hold it; a stale one may
+    # have been taken over by a retry in the meantime.
+    held = IdempotencyKey.objects.filter(pk=record.pk, locked_at=record.locked_at)
+    try:
+        with db_transaction.atomic():
+            if not held.select_for_update().exists():
+                raise _LostReservation
+            status_code, body = run()
+            if status_code >= 500:
+                # Server errors are not a final answer; let the client retry.
+                held.delete()
+            elif not held.update(response_status=status_code, response_body=body):
+                raise _LostReservation
+    except _LostReservation:
+        return _in_progress()
+    except Exception:
+        held.delete()
+        raise
+    return status_code, body, False
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired keys in batches; returns how many were removed."""
+    purged = 0
+    while True:
+        expired = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+                       .values_list('pk', flat=True)[:batch_size])
+        if not expired:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=expired).delete()[0]
+
+
+def _reserve(user, endpoint, key, request_hash):
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(user=user, endpoint=endpoint, key=key).first()
+    if record is not None and record.expires_at > now:
+        lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', timedelta(minutes=1))
+        if record.response_status is None and record.request_hash == request_hash \
+                and record.locked_at <= now - lock_timeout:
+            # Abandoned reservation; take it over unless another retry just did.
+            if IdempotencyKey.objects.filter(pk=record.pk, response_status__isnull=True,
+                                             locked_at=record.locked_at).update(locked_at=now):
+                record.locked_at = now
+                record.reserved = True
+        return record
+    if record is not None:
+        record.delete()
+
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', timedelta(hours=24))
+    try:
+        with db_transaction.atomic():
+            record = IdempotencyKey.objects.create(user=user, endpoint=endpoint, key=key,
+                                                   request_hash=request_hash, locked_at=now, expires_at=now + ttl)
+    except IntegrityError:
+        # A concurrent request with the same key won the insert.
+        return IdempotencyKey.objects.get(user=user, endpoint=endpoint, key=key)
+    record.reserved = True
+    return record
+
+
+def _in_progress():
+    return status.HTTP_409_CONFLICT, {'error': f'A request with this {HEADER} is still in progress'}, False
+
+
+def _fingerprint(data):
+    payload = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
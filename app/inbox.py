@@ -0,0 +1,109 @@
+"""
+Durable inbox for anchor callbacks.
+
+Webhook views only insert a ``CallbackInbox`` row; ``drain()`` later claims
+pending rows in batches, collapses repeated callbacks for the same
+``external_transaction_id`` to the most recent one (a final status wins
+over a later in-progress one), and settles the matching transactions in a
+single database transaction per batch.
+
+A callback can arrive before the outbox has recorded the anchor's id on
+its transaction. Such callbacks stay pending and are retried with backoff
+until ``CALLBACK_UNMATCHED_TIMEOUT`` after receipt, and only then failed.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CallbackInbox, Transaction
+from .outbox import backoff
+from .transact import FINAL_STATUSES, settle_transactions
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(kind, callback_data):
+    return CallbackInbox.objects.create(
+        kind=kind,
+        external_transaction_id=callback_data['transaction_id'],
+        payload=callback_data
+    )
+
+
+def drain(batch_size=100):
+    """Process one batch of pending callbacks; returns how many were claimed."""
+    with db_transaction.atomic():
+        batch = list(CallbackInbox.objects.select_for_update(skip_locked=True)
+                     .filter(state='pending', next_attempt_at__lte=timezone.now()).order_by('id')[:batch_size])
+        if not batch:
+            return 0
+        try:
+            with db_transaction.atomic():
+                _process(batch)
+        except Exception as e:
+            logger.exception("Failed to process callback batch")
+            _record_failure(batch, e)
+    return len(batch)
+
+
+def _process(batch):
+    latest = {}
+    for entry in batch:
+        key = (entry.kind, entry.external_transaction_id)
+        kept = latest.get(key)
+        # Callbacks can arrive out of order; never let "pending" undo "completed".
+        if kept is None or _is_final(entry) or not _is_final(kept):
+            latest[key] = entry
+    duplicates = [entry.pk for entry in batch if latest[(entry.kind, entry.external_transaction_id)] is not entry]
+
+    transaction_ids = dict(
+        Transaction.objects.filter(external_transaction_id__in={ext_id for _, ext_id in latest})
+        .values_list('external_transaction_id', 'pk')
+    )
+    outcomes = {}
+    processed, missing = [], []
+    for (kind, ext_id), entry in latest.items():
+        pk = transaction_ids.get(ext_id)
+        if pk is None:
+            missing.append(entry)
+            continue
+        outcomes[pk] = entry.payload.get('status')
+        processed.append(entry.pk)
+        if kind == 'withdrawal' and outcomes[pk] == 'failed':
+            logger.error(f"Withdrawal failed for transaction {ext_id}")
+
+    settle_transactions(outcomes)
+
+    now = timezone.now()
+    CallbackInbox.objects.filter(pk__in=processed).update(state='processed', processed_at=now)
+    CallbackInbox.objects.filter(pk__in=duplicates).update(state='duplicate', processed_at=now)
+    _retry_unmatched(missing, now)
+
+
+def _is_final(entry):
+    return entry.payload.get('status') in FINAL_STATUSES
+
+
+def _retry_unmatched(entries, now):
+    timeout = getattr(settings, 'CALLBACK_UNMATCHED_TIMEOUT', timedelta(days=1))
+    for entry in entries:
+        if entry.received_at <= now - timeout:
+            logger.error(f"Giving up on {entry.kind} callback for unknown transaction {entry.external_transaction_id}")
+            CallbackInbox.objects.filter(pk=entry.pk).update(
+                state='failed', attempts=entry.attempts + 1, processed_at=now, last_error='Transaction not found')
+        else:
+            CallbackInbox.objects.filter(pk=entry.pk).update(
+                attempts=entry.attempts + 1, last_error='Transaction not found',
+                next_attempt_at=now + backoff(entry.attempts + 1))
+
+
+def _record_failure(batch, error):
+    pks = [entry.pk for entry in batch]
+    CallbackInbox.objects.filter(pk__in=pks).update(attempts=F('attempts') + 1, last_error=str(error))
+    max_attempts = getattr(settings, 'CALLBACK_MAX_ATTEMPTS', 5)
+    CallbackInbox.objects.filter(pk__in=pks, attempts__gte=max_attempts).update(
+        state='failed', processed_at=timezone.now())
@@ -0,0 +1,139 @@
+"""
+Append-only double-entry ledger.
+
+Every balance change is recorded as a set of ``Posting`` legs whose debits
+and credits cancel out. An account's ledger balance is its latest
+``BalanceSnapshot`` plus the postings written after it, and ``compact()``
+periodically rolls snapshots forward so reads only ever scan recent
+postings.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Sum, Q, Max, OuterRef, Subquery, Exists
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Posting, BalanceSnapshot, USDAccount
+
+# The platform clearing account: the other side of money entering or
+# leaving the platform (anchor deposits, withdrawals, fees).
+CLEARING = None
+
+
+class UnbalancedPostingError(Exception):
+    pass
+
+
+def debit(account, amount):
+    return account, 'debit', amount
+
+
+def credit(account, amount):
+    return account, 'credit', amount
+
+
+def post(transaction, legs):
+    """
+    Record ``legs`` against ``transaction``.
+
+    Each leg is an ``(account, side, amount)`` tuple as built by ``debit()``
+    and ``credit()``, where ``account`` is a user, a user id or ``CLEARING``.
+    """
+    return post_many([(transaction, legs)])
+
+
+def post_many(entries):
+    """Record several ``(transaction, legs)`` entries with one bulk insert."""
+    postings = []
+    for transaction, legs in entries:
+        postings.extend(_build_postings(transaction, legs))
+    return Posting.objects.bulk_create(postings)
+
+
+def _build_postings(transaction, legs):
+    postings = [
+        Posting(transaction=transaction, account_id=_account_key(account), side=side, amount=amount)
+        for account, side, amount in legs
+        if amount
+    ]
+    debits = sum((p.amount for p in postings if p.side == 'debit'), Decimal('0'))
+    credits = sum((p.amount for p in postings if p.side == 'credit'), Decimal('0'))
+    if debits != credits:
+        raise UnbalancedPostingError(f"Debits {debits} do not match credits {credits}")
+    return postings
+
+
+def balance(account):
+    """Ledger balance of ``account``: last snapshot plus later postings."""
+    account_id = _account_key(account)
+    snapshot = (BalanceSnapshot.objects.filter(account_id=account_id)
+                .order_by('-posting_id').values_list('balance', 'posting_id').first())
+    base, cursor = snapshot or (Decimal('0'), 0)
+    return base + _sum_postings(account_id, cursor)
+
+
+def compact(lag=None):
+    """
+    Write a fresh snapshot for every account with postings since its last one.
+
+    Only postings older than ``lag`` are folded in: ids are allocated before
+    commit, so a very recent id may still belong to an open transaction and
+    must not be skipped over by the snapshot cursor.
+    """
+    if lag is None:
+        lag = getattr(settings, 'LEDGER_SNAPSHOT_LAG', timedelta(minutes=5))
+    horizon = (Posting.objects.filter(created_at__lte=timezone.now() - lag)
+               .aggregate(horizon=Max('id'))['horizon'])
+    if horizon is None:
+        return 0
+
+    latest = BalanceSnapshot.objects.filter(account_id=OuterRef('user_id')).order_by('-posting_id')
+    stale = (USDAccount.objects
+             .annotate(cursor=Coalesce(Subquery(latest.values('posting_id')[:1]), 0))
+             .filter(Exists(Posting.objects.filter(account_id=OuterRef('user_id'),
+                                                   id__gt=OuterRef('cursor'), id__lte=horizon)))
+             .values_list('user_id', flat=True))
+
+    rolled = 0
+    for account_id in stale.iterator():
+        _roll_forward(account_id, horizon)
+        rolled += 1
+    if _roll_forward(CLEARING, horizon):
+        rolled += 1
+    return rolled
+
+
+def _roll_forward(account_id, horizon):
+    with db_transaction.atomic():
+        snapshot = (BalanceSnapshot.objects.filter(account_id=account_id)
+                    .order_by('-posting_id').values_list('balance', 'posting_id').first())
+        base, cursor = snapshot or (Decimal('0'), 0)
+        if cursor >= horizon or not Posting.objects.filter(account_id=account_id, id__gt=cursor,
+                                                           id__lte=horizon).exists():
+            return False
+        BalanceSnapshot.objects.create(
+            account_id=account_id,
+            balance=base + _sum_postings(account_id, cursor, horizon),
+            posting_id=horizon
+        )
+    return True
+
+
+def _sum_postings(account_id, after, upto=None):
+    postings = Posting.objects.filter(account_id=account_id, id__gt=after)
+    if upto is not None:
+        postings = postings.filter(id__lte=upto)
+    totals = postings.aggregate(
+        credits=Sum('amount', filter=Q(side='credit')),
+        debits=Sum('amount', filter=Q(side='debit')),
+    )
+    return (totals['credits'] or Decimal('0')) - (totals['debits'] or Decimal('0'))
+
+
+def _account_key(account):
+    if isinstance(account, USDAccount):
+        return account.user_id
+    return getattr(account, 'pk', account)
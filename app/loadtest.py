@@ -0,0 +1,155 @@
+"""
+HTTP load driver for the money-moving endpoints.
+
+``prepare_users()`` creates KYC-approved users with funded accounts and
+knox tokens. ``run()`` then keeps ``concurrency`` workers sending a weighted
+mix of deposit, withdrawal, transfer and anchor callback requests to a
+running server and returns per-endpoint throughput and latency percentiles.
+Point the server at ``manage.py mock_anchor`` to keep everything local.
+Callbacks are signed with ``WEBHOOKS['anchor']``, so the server under test
+must share that secret.
+"""
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+import requests
+from django.db import transaction as db_transaction
+from knox.models import AuthToken
+
+from . import webhooks
+from .models import User, UserProfile, USDAccount
+
+ENDPOINTS = {
+    'deposit': 'deposit/',
+    'withdraw': 'withdraw/',
+    'transfer': 'transfer/',
+    'callback': 'callback/deposit/',
+}
+DEFAULT_MIX = {'deposit': 3, 'withdraw': 2, 'transfer': 4, 'callback': 1}
+
+
+def parse_mix(spec):
+    """``'deposit=3,transfer=1'`` -> ``{'deposit': 3, 'transfer': 1}``."""
+    mix = {}
+    for item in filter(None, spec.split(',')):
+        name, _, weight = item.partition('=')
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in mix: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed):
+    """Count, throughput and latency percentiles (in milliseconds) for a list of seconds."""
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'throughput': len(values) / elapsed if elapsed else 0.0,
+        'mean_ms': 1000 * sum(values) / len(values) if values else 0.0,
+        'p50_ms': 1000 * percentile(values, 0.50),
+        'p95_ms': 1000 * percentile(values, 0.95),
+        'p99_ms': 1000 * percentile(values, 0.99),
+        'max_ms': 1000 * values[-1] if values else 0.0,
+    }
+
+
+def prepare_users(count, prefix='loadtest', balance=Decimal('1000000.00')):
+    """Create (or reuse) ``count`` funded, verified users; returns ``[(username, token)]``."""
+    users = []
+    for index in range(count):
+        username = f"{prefix}-{index}"
+        with db_transaction.atomic():
+            user, _ = User.objects.get_or_create(username=username,
+                                                 defaults={'email': f"{username}@example.com"})
+            UserProfile.objects.update_or_create(user=user, defaults={'kyc_status': 'approved', 'region': 'US'})
+            USDAccount.objects.update_or_create(user=user, defaults={'balance': balance})
+            _, token = AuthToken.objects.create(user)
+        users.append((username, token))
+    return users
+
+
+def run(base_url, users, mix=None, concurrency=16, duration=None, total=None, timeout=30.0):
+    """
+    Drive load until ``duration`` seconds pass or ``total`` requests are sent.
+    Returns ``{'elapsed', 'endpoints': {name: summary + errors}, 'overall'}``.
+    """
+    mix = mix or DEFAULT_MIX
+    names, weights = zip(*mix.items())
+    base_url = base_url.rstrip('/') + '/'
+    results = {name: {'latencies': [], 'errors': 0} for name in names}
+    lock = threading.Lock()
+    sent = [0]
+    started = time.monotonic()
+
+    def claim():
+        with lock:
+            if total is not None and sent[0] >= total:
+                return False
+            sent[0] += 1
+        return duration is None or time.monotonic() - started < duration
+
+    def work():
+        session = requests.Session()
+        while claim():
+            name = random.choices(names, weights)[0]
+            username, token = random.choice(users)
+            url, body, headers = _request(name, base_url, username, token, users)
+            began = time.monotonic()
+            try:
+                response = session.post(url, data=body, headers=headers, timeout=timeout)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            latency = time.monotonic() - began
+            with lock:
+                results[name]['latencies'].append(latency)
+                results[name]['errors'] += 0 if ok else 1
+
+    workers = [threading.Thread(target=work, name=f'load-{index}') for index in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    report = {'elapsed': elapsed, 'endpoints': {}}
+    for name, result in results.items():
+        report['endpoints'][name] = {**summarize(result['latencies'], elapsed), 'errors': result['errors']}
+    everything = [latency for result in results.values() for latency in result['latencies']]
+    report['overall'] = {**summarize(everything, elapsed),
+                         'errors': sum(result['errors'] for result in results.values())}
+    return report
+
+
+def _request(name, base_url, username, token, users):
+    """``(url, body, headers)`` for one request; the body is encoded JSON so callbacks can be signed."""
+    headers = {'Authorization': f"Token {token}", 'Idempotency-Key': str(uuid.uuid4()),
+               'Content-Type': 'application/json'}
+    amount = f"{random.randint(1, 500) / 100:.2f}"
+    if name == 'transfer':
+        recipient = random.choice([other for other, _ in users if other != username] or [username])
+        body = {'recipient': recipient, 'amount': amount}
+    elif name == 'callback':
+        body = json.dumps({'transaction_id': str(uuid.uuid4()), 'status': 'completed'}).encode()
+        return base_url + ENDPOINTS[name], body, {'Content-Type': 'application/json', **_signature(body)}
+    else:
+        body = {'amount': amount}
+    return base_url + ENDPOINTS[name], json.dumps(body).encode(), headers
+
+
+def _signature(body):
+    config = webhooks.provider_config(webhooks.ANCHOR)
+    return {config['header']: hmac.new(config['secret'].encode(), body, config['digest']).hexdigest()}
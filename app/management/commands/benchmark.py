@@ -0,0 +1,69 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from app import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the core money paths at several dataset sizes in a throwaway test database, "
+            "write the results as JSON and optionally fail on regressions against a baseline. "
+            "Set POSTGRES_DB (and POSTGRES_USER/PASSWORD/HOST/PORT) to run against PostgreSQL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help="Comma-separated transaction counts, e.g. 1000,100000,10000000.")
+        parser.add_argument('--benchmarks', default='', help="Comma-separated benchmark names (default: all).")
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--users', type=int, default=1000, help="Users the seeded transactions are spread over.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument('--compare', metavar='BASELINE', help="Fail if results regress against this report.")
+        parser.add_argument('--max-throughput-drop', type=float, default=0.10,
+                            help="Allowed fractional drop in ops/sec before failing.")
+        parser.add_argument('--max-p99-increase', type=float, default=0.20,
+                            help="Allowed fractional rise in p99 latency before failing.")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Keep the benchmark database and its seeded rows for the next run.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size]
+            names = benchmarks.parse_names(options['benchmarks'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        baseline = None
+        if options['compare']:
+            baseline = json.loads(Path(options['compare']).read_text())
+
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            # Benchmark an on-disk database, not the in-memory default for tests.
+            connection.settings_dict['TEST']['NAME'] = str(Path(connection.settings_dict['NAME'])
+                                                           .with_name('benchmark.sqlite3'))
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb'])
+        try:
+            report = benchmarks.run(sizes, options['iterations'], options['warmup'], names, options['users'],
+                                    progress=self._progress)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = benchmarks.compare(baseline, report, options['max_throughput_drop'],
+                                             options['max_p99_increase'])
+            if regressions:
+                raise CommandError("Benchmarks regressed:\n  " + "\n  ".join(regressions))
+            self.stderr.write("No regressions against the baseline.")
+
+    def _progress(self, result):
+        self.stderr.write(f"{result['benchmark']:<18} {result['size']:>10} rows "
+                          f"{result['throughput']:>9.1f} ops/s  p50 {result['p50_ms']:>7.2f} ms  "
+                          f"p99 {result['p99_ms']:>7.2f} ms")
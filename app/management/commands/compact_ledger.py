@@ -0,0 +1,25 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import ledger
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Roll ledger balance snapshots forward so balance reads only scan recent postings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep compacting until interrupted.")
+        parser.add_argument('--interval', type=float, default=60.0, help="Seconds between passes with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            rolled = ledger.compact()
+            logger.info(f"Rolled {rolled} ledger snapshots forward")
+            self.stdout.write(f"Rolled {rolled} snapshots forward")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app import outbox, providers
+
+
+class Command(BaseCommand):
+    help = "Send queued anchor calls from the outbox, with retries and backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=16, help="Anchor calls in flight at once.")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="Exit when no messages are due.")
+
+    def handle(self, *args, **options):
+        anchor_service = providers.stellar()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            while True:
+                close_old_connections()
+                handled = outbox.dispatch(anchor_service, executor, options['batch_size'])
+                if not handled:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Drive deposit, withdrawal, transfer and callback traffic at a running server and report "
+            "throughput and latency percentiles. Raise THROTTLE_USER_RATE/THROTTLE_ANON_RATE on the server first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api/')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=None, help="Seconds to run for.")
+        parser.add_argument('--requests', type=int, default=None, help="Total requests to send.")
+        parser.add_argument('--mix', default='deposit=3,withdraw=2,transfer=4,callback=1',
+                            help="Relative weights per endpoint.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        if options['duration'] is None and options['requests'] is None:
+            options['duration'] = 30.0
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        users = loadtest.prepare_users(options['users'])
+        report = loadtest.run(options['base_url'], users, mix=mix, concurrency=options['concurrency'],
+                              duration=options['duration'], total=options['requests'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{'endpoint':<10} {'count':>7} {'errors':>7} {'req/s':>8} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, row in [*report['endpoints'].items(), ('overall', report['overall'])]:
+            self.stdout.write(f"{name:<10} {row['count']:>7} {row['errors']:>7} {row['throughput']:>8.1f} "
+                              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+                              f"{row['max_ms']:>8.1f}")
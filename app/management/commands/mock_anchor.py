@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.mock_anchor import MockAnchor, parse_latency
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for the anchor, Flutterwave, Circle and Horizon."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--latency', default='fixed:0',
+                            help="fixed:MS, uniform:MIN-MAX or lognormal:MEDIAN,SIGMA (milliseconds).")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests that get a 503.")
+        parser.add_argument('--route-error', action='append', default=[], metavar='PREFIX=RATE',
+                            help="Error rate for paths starting with PREFIX; may be repeated.")
+        parser.add_argument('--transaction-status', default='completed',
+                            help="SEP-24 status reported for every transaction.")
+
+    def handle(self, *args, **options):
+        try:
+            parse_latency(options['latency'])
+            route_error_rates = {prefix: float(rate) for prefix, rate in
+                                 (item.split('=', 1) for item in options['route_error'])}
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        anchor = MockAnchor(options['host'], options['port'], latency=options['latency'],
+                            error_rate=options['error_rate'], route_error_rates=route_error_rates,
+                            transaction_status=options['transaction_status'])
+        self.stdout.write(f"Mock anchor listening on {anchor.url}")
+        self.stdout.write(f"  ANCHOR_URL={anchor.url} STELLAR_HORIZON_URL={anchor.url} "
+                          f"FLUTTERWAVE_API_URL={anchor.url}/v3 CIRCLE_API_URL={anchor.url}/v1/")
+        try:
+            anchor.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            anchor.server.server_close()
@@ -0,0 +1,50 @@
+import logging
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from app import inbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Drain the anchor callback inbox with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds an idle worker waits before polling again.")
+        parser.add_argument('--once', action='store_true', help="Exit once the inbox is empty.")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=self._work, args=(stop, options), name=f'callback-worker-{index}')
+            for index in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(timeout=0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    @staticmethod
+    def _work(stop, options):
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                claimed = inbox.drain(options['batch_size'])
+                if not claimed:
+                    if options['once']:
+                        break
+                    stop.wait(options['poll_interval'])
+        finally:
+            connection.close()
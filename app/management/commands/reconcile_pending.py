@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from app.reconcile import Reconciler
+
+
+class Command(BaseCommand):
+    help = "Check pending transactions with their providers and settle the ones that have finished."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=32, help="Status requests in flight at once.")
+        parser.add_argument('--min-age', type=int, default=300,
+                            help="Only check transactions pending for at least this many seconds.")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after checking this many transactions.")
+
+    def handle(self, *args, **options):
+        totals = Reconciler(concurrency=options['concurrency']).run(
+            chunk_size=options['chunk_size'],
+            min_age=timedelta(seconds=options['min_age']),
+            limit=options['limit'],
+        )
+        self.stdout.write(f"Checked {totals['checked']} pending transactions: "
+                          f"{totals['completed']} completed, {totals['failed']} failed")
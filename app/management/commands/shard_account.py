@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import USDAccount
+
+
+class Command(BaseCommand):
+    help = "Split a hot account's balance across N sub-balance rows (0 folds it back into one row)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('shards', type=int)
+
+    def handle(self, *args, **options):
+        if options['shards'] < 0:
+            raise CommandError("shards must be zero or positive")
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+            USDAccount.objects.set_shard_count(user, options['shards'])
+        except (get_user_model().DoesNotExist, USDAccount.DoesNotExist):
+            raise CommandError(f"No USD account for {options['username']}")
+        self.stdout.write(f"{options['username']} now uses {options['shards']} shards; "
+                          f"balance {USDAccount.objects.balance_of(user)}")
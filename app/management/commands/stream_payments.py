@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from stellar_sdk import Keypair, Server
+
+from app import payment_stream
+from app.transport import horizon_client
+
+logger = logging.getLogger(__name__)
+
+STOP = object()
+
+
+class Command(BaseCommand):
+    help = "Stream payments to the platform account from Horizon and complete the deposits they pay."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default='platform-payments', help="Cursor name to persist progress under.")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--flush-interval', type=float, default=1.0,
+                            help="Seconds to wait for more records before applying a partial batch.")
+        parser.add_argument('--reconnect-delay', type=float, default=1.0,
+                            help="Initial delay before reconnecting; doubles up to 60s while failures repeat.")
+
+    def handle(self, *args, **options):
+        server = Server(settings.STELLAR_HORIZON_URL, client=horizon_client())
+        account_id = Keypair.from_secret(settings.STELLAR_PLATFORM_SECRET).public_key
+        asset = ('USDC', settings.USDC_ISSUER_PUBLIC_KEY)
+        records = queue.Queue(maxsize=options['batch_size'] * 4)
+        delay = options['reconnect_delay']
+
+        while True:
+            # Each connection starts from the last cursor that was applied.
+            cursor = payment_stream.load_cursor(options['name'])
+            self.stdout.write(f"Streaming payments for {account_id} from cursor {cursor}")
+            reader = threading.Thread(target=self._read, args=(server, account_id, cursor, records),
+                                      name='horizon-stream', daemon=True)
+            reader.start()
+            try:
+                applied = self._apply_batches(records, options, account_id, asset)
+            except KeyboardInterrupt:
+                return
+            if applied:
+                delay = options['reconnect_delay']
+            logger.warning(f"Payment stream disconnected; reconnecting in {delay:.1f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+    @staticmethod
+    def _read(server, account_id, cursor, records):
+        try:
+            stream = server.payments().for_account(account_id).join('transactions').cursor(cursor).stream()
+            for record in stream:
+                records.put(record)
+        except Exception as e:
+            logger.warning(f"Payment stream failed: {e}")
+        finally:
+            records.put(STOP)
+
+    @staticmethod
+    def _apply_batches(records, options, account_id, asset):
+        """Apply batches until the reader stops; returns whether anything was applied."""
+        applied = False
+        while True:
+            batch, stopped = [], False
+            deadline = None
+            while len(batch) < options['batch_size']:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    record = records.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is STOP:
+                    stopped = True
+                    break
+                batch.append(record)
+                if deadline is None:
+                    deadline = time.monotonic() + options['flush_interval']
+
+            if batch:
+                close_old_connections()
+                settled = payment_stream.apply(options['name'], batch, account_id, *asset)
+                applied = True
+                if settled:
+                    logger.info(f"Completed {len(settled)} deposits from {len(batch)} stream records")
+            if stopped:
+                return applied
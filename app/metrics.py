@@ -0,0 +1,260 @@
+"""
+In-process request metrics in the Prometheus text format.
+
+Counters and histograms are pre-aggregated in per-thread shards: a thread
+only ever writes to its own shard, so recording takes no lock, and a
+scrape sums the shards. Shards of threads that have exited are folded into
+a retired shard at scrape time so their counts are kept.
+
+``MetricsMiddleware`` times every request by endpoint (the URL pattern's
+name, never the raw path) and attributes the database and provider HTTP
+time spent while serving it, so a scrape shows e.g. how much of
+``deposit`` goes to the anchor and how much to the database:
+
+* ``http_request_duration_seconds{endpoint,method,status}`` (histogram);
+* ``http_request_db_queries_total`` / ``http_request_db_seconds_total``
+  ``{endpoint}``;
+* ``http_request_provider_seconds_total{endpoint,provider}``;
+* ``db_query_duration_seconds`` (histogram, every query);
+* ``provider_request_duration_seconds{provider,outcome}`` (histogram,
+  every outbound provider call, recorded by ``transport``).
+
+Per-request attribution is carried in a context variable, so it follows
+the request into ``sync_to_async`` threads. Queries are timed by an
+execute wrapper installed on each database connection as it is created.
+"""
+import contextvars
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Histogram bucket upper bounds in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', "Time spent serving requests."),
+    'http_request_db_queries_total': ('counter', "Database queries run while serving requests."),
+    'http_request_db_seconds_total': ('counter', "Database time spent while serving requests."),
+    'http_request_provider_seconds_total': ('counter', "Provider HTTP time spent while serving requests."),
+    'db_query_duration_seconds': ('histogram', "Database query latency."),
+    'provider_request_duration_seconds': ('histogram', "Outbound payment provider HTTP latency."),
+}
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+        self.histograms = {}
+
+    def merge(self, other):
+        for key, value in other.counters.copy().items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in other.histograms.copy().items():
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    mine[index] += value
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(self.buckets) + 2)
+        index = 0
+        for bound in self.buckets:
+            if seconds <= bound:
+                break
+            index += 1
+        values[index] += 1
+        values[-1] += seconds
+
+    def collect(self):
+        """A single shard holding the totals across all threads."""
+        total = _Shard()
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._retired.merge(shard)
+            self._shards = live
+            total.merge(self._retired)
+            for _, shard in live:
+                total.merge(shard)
+        return total
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        total = self.collect()
+        series = {}
+        for (name, labels), value in total.counters.items():
+            series.setdefault(name, []).append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), values in total.histograms.items():
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), values[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+        output = []
+        for name in sorted(series):
+            kind, description = METRICS.get(name, ('untyped', name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(sorted(series[name]))
+        return '\n'.join(output) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._shards = []
+            self._retired = _Shard()
+            self._local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+class RequestStats:
+    """Database and provider time spent while serving the current request."""
+    __slots__ = ('db_queries', 'db_seconds', 'provider_seconds')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.provider_seconds = {}
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def observe_provider(provider, seconds, outcome):
+    """Record one outbound call to ``provider``; called by ``transport``."""
+    registry.observe('provider_request_duration_seconds', (('provider', provider), ('outcome', outcome)), seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.provider_seconds[provider] = stats.provider_seconds.get(provider, 0.0) + seconds
+
+
+def status_class(status_code):
+    """``'2xx'``, ``'4xx'``... for a response status; the provider histogram's ``outcome`` label."""
+    return f"{status_code // 100}xx"
+
+
+def _execute(execute, sql, params, many, context):
+    began = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - began
+        registry.observe('db_query_duration_seconds', (), seconds)
+        stats = _current.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += seconds
+
+
+def install_db_hooks(sender, connection, **kwargs):
+    """``connection_created`` receiver that times every query on the new connection."""
+    if _execute not in connection.execute_wrappers:
+        # Go first, so a ``connection.execute_wrapper()`` block that is open
+        # while the connection is created still pops its own wrapper.
+        connection.execute_wrappers.insert(0, _execute)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        began = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            _current.reset(token)
+            _record(request, status, time.perf_counter() - began, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        began = time.perf_counter()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            _current.reset(token)
+            _record(request, status, time.perf_counter() - began, stats)
+
+
+def _record(request, status, seconds, stats):
+    match = getattr(request, 'resolver_match', None)
+    endpoint = match.view_name if match is not None else 'unmatched'
+    registry.observe('http_request_duration_seconds',
+                     (('endpoint', endpoint), ('method', request.method), ('status', str(status))), seconds)
+    labels = (('endpoint', endpoint),)
+    registry.inc('http_request_db_queries_total', labels, stats.db_queries)
+    registry.inc('http_request_db_seconds_total', labels, stats.db_seconds)
+    for provider, provider_seconds in stats.provider_seconds.items():
+        registry.inc('http_request_provider_seconds_total', labels + (('provider', provider),), provider_seconds)
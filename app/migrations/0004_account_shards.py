@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_transaction_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usdaccount',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='AccountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='app.usdaccount', to_field='user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'index'), name='unique_account_shard')],
+            },
+        ),
+    ]
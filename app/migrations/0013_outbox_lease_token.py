@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_callback_inbox_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='lease_token',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_outbox_lease_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='provider',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+    ]
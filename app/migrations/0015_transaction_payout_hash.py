@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_transaction_provider'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='payout_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,253 @@
+"""
+Stand-in for the external services the app talks to, for offline tests and
+load tests.
+
+One HTTP server emulates:
+
+* the SEP-10 and SEP-24 anchor endpoints (``/auth``, interactive deposit
+  and withdrawal, transaction status) and the ``stellar.toml`` publishing
+  the SEP-10 signing key;
+* Flutterwave (``/v3/payments``, ``/v3/transactions/<id>/verify``) and
+  Circle (``/v1/payments``, ``/v1/payments/<id>``);
+* the Horizon calls behind ``load_account`` and ``submit_transaction``,
+  keeping sequence numbers so out-of-order submissions get ``tx_bad_seq``.
+
+Latency is drawn from a distribution given as ``fixed:MS``,
+``uniform:MIN-MAX`` or ``lognormal:MEDIAN,SIGMA`` (milliseconds). A share of
+requests set by ``error_rate`` fails with 503, and ``route_error_rates``
+overrides that per path prefix. Run it with ``manage.py mock_anchor`` and point
+``ANCHOR_URL`` and ``STELLAR_HORIZON_URL`` at it, or use ``MockAnchor`` from
+tests.
+"""
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from stellar_sdk import Keypair, Network, TransactionEnvelope
+from stellar_sdk.sep.stellar_web_authentication import build_challenge_transaction
+
+
+def parse_latency(spec):
+    """A function returning one latency sample in seconds, from a ``kind:params`` spec."""
+    kind, _, params = (spec or 'fixed:0').partition(':')
+    if kind == 'fixed':
+        value = float(params or 0) / 1000
+        return lambda: value
+    if kind == 'uniform':
+        low, high = (float(part) / 1000 for part in params.split('-'))
+        return lambda: random.uniform(low, high)
+    if kind == 'lognormal':
+        median, sigma = (float(part) for part in params.split(','))
+        mu = math.log(median / 1000)
+        return lambda: random.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+@dataclass
+class MockConfig:
+    latency: str = 'fixed:0'
+    error_rate: float = 0.0
+    route_error_rates: dict = field(default_factory=dict)
+    network_passphrase: str = Network.PUBLIC_NETWORK_PASSPHRASE
+    token_ttl: int = 3600
+    transaction_status: str = 'completed'
+
+
+class MockState:
+    def __init__(self, config):
+        self.config = config
+        self.sample_latency = parse_latency(config.latency)
+        self.signing_key = Keypair.random()
+        self.sequences = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def error_rate(self, path):
+        for prefix, rate in self.config.route_error_rates.items():
+            if path.startswith(prefix):
+                return rate
+        return self.config.error_rate
+
+    def next_sequence(self, account_id, sequence):
+        """Apply a transaction's sequence number; returns whether it was the expected one."""
+        with self.lock:
+            current = self.sequences.setdefault(account_id, 1000)
+            if sequence != current + 1:
+                return False
+            self.sequences[account_id] = sequence
+            return True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockAnchor/1.0'
+
+    ROUTES = [
+        ('GET', r'/\.well-known/stellar\.toml', 'stellar_toml'),
+        ('GET', r'/auth', 'challenge'),
+        ('POST', r'/auth', 'token'),
+        ('POST', r'/transactions/(deposit|withdraw)/interactive', 'interactive'),
+        ('GET', r'/transactions?/(?P<id>[^/]+)', 'sep24_status'),
+        ('POST', r'/v3/payments', 'flutterwave_payment'),
+        ('GET', r'/v3/transactions/(?P<id>[^/]+)/verify', 'flutterwave_verify'),
+        ('POST', r'/v1/payments', 'circle_payment'),
+        ('GET', r'/v1/payments/(?P<id>[^/]+)', 'circle_status'),
+        ('GET', r'/accounts/(?P<id>[^/]+)', 'horizon_account'),
+        ('POST', r'/transactions', 'horizon_submit'),
+    ]
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        with self.state.lock:
+            self.state.requests += 1
+
+        time.sleep(self.state.sample_latency())
+        if random.random() < self.state.error_rate(url.path):
+            return self._send(503, {'error': 'Injected failure'})
+        for route_method, pattern, name in self.ROUTES:
+            match = re.fullmatch(pattern, url.path.rstrip('/') or '/')
+            if route_method == method and match:
+                return getattr(self, name)(**match.groupdict())
+        self._send(404, {'error': 'Not found'})
+
+    def _json_body(self):
+        try:
+            return json.loads(self.body or b'{}')
+        except ValueError:
+            return {}
+
+    def _send(self, status, payload, content_type='application/json'):
+        body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # SEP-10 / SEP-24
+
+    def stellar_toml(self):
+        host = self.headers.get('Host')
+        self._send(200, f'SIGNING_KEY = "{self.state.signing_key.public_key}"\n'
+                        f'WEB_AUTH_ENDPOINT = "http://{host}/auth"\n', content_type='text/plain')
+
+    def challenge(self):
+        account = self.query.get('account')
+        if not account:
+            return self._send(400, {'error': 'account is required'})
+        memo = int(self.query['memo']) if self.query.get('memo', '').isdigit() else None
+        host = self.headers.get('Host', 'localhost').split(':')[0]
+        transaction = build_challenge_transaction(self.state.signing_key.secret, account, host, host,
+                                                  self.state.config.network_passphrase, memo=memo)
+        self._send(200, {'transaction': transaction,
+                         'network_passphrase': self.state.config.network_passphrase})
+
+    def token(self):
+        transaction = self._json_body().get('transaction')
+        if not transaction:
+            return self._send(400, {'error': 'transaction is required'})
+        claims = {'sub': 'mock', 'iat': int(time.time()), 'exp': int(time.time()) + self.state.config.token_ttl}
+        payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip('=')
+        self._send(200, {'token': f"e30.{payload}.mock"})
+
+    def interactive(self):
+        transaction_id = str(uuid.uuid4())
+        self._send(200, {'type': 'interactive_customer_info_needed', 'id': transaction_id,
+                         'url': f"http://{self.headers.get('Host')}/interactive/{transaction_id}"})
+
+    def sep24_status(self, id):
+        self._send(200, {'transaction': {'id': id, 'status': self.state.config.transaction_status}})
+
+    # Fiat providers
+
+    def flutterwave_payment(self):
+        self._send(200, {'status': 'success', 'message': 'Hosted Link',
+                         'data': {'link': f"http://{self.headers.get('Host')}/pay/{uuid.uuid4()}"}})
+
+    def flutterwave_verify(self, id):
+        self._send(200, {'status': 'success', 'data': {'id': id, 'status': 'successful'}})
+
+    def circle_payment(self):
+        self._send(200, {'data': {'id': str(uuid.uuid4()), 'status': 'pending',
+                                  'amount': self._json_body().get('amount')}})
+
+    def circle_status(self, id):
+        self._send(200, {'data': {'id': id, 'status': 'confirmed'}})
+
+    # Horizon
+
+    def horizon_account(self, id):
+        with self.state.lock:
+            sequence = self.state.sequences.setdefault(id, 1000)
+        self._send(200, {'id': id, 'account_id': id, 'sequence': str(sequence), 'data': {},
+                         'balances': [], 'signers': []})
+
+    def horizon_submit(self):
+        xdr = parse_qs(self.body.decode()).get('tx', [''])[0]
+        try:
+            envelope = TransactionEnvelope.from_xdr(xdr, self.state.config.network_passphrase)
+        except Exception:
+            return self._send(400, {'title': 'Transaction Malformed', 'extras': {'envelope_xdr': xdr}})
+        transaction = envelope.transaction
+        if not self.state.next_sequence(transaction.source.account_id, transaction.sequence):
+            return self._send(400, {'title': 'Transaction Failed', 'extras': {
+                'envelope_xdr': xdr, 'result_codes': {'transaction': 'tx_bad_seq'}}})
+        tx_hash = envelope.hash_hex()
+        self._send(200, {'hash': tx_hash, 'successful': True, 'ledger': 1, 'envelope_xdr': xdr,
+                         'id': tx_hash, 'paging_token': hashlib.sha1(tx_hash.encode()).hexdigest()})
+
+
+class MockAnchor:
+    """Run the mock server on a background thread; ``url`` is its base URL."""
+
+    def __init__(self, host='127.0.0.1', port=0, **config):
+        self.config = MockConfig(**config)
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.state = MockState(self.config)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='mock-anchor', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,6 +1,11 @@
+import random
 import uuid
+from decimal import Decimal
 
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F, Sum, Case, When, Value
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 
@@ -25,6 +30,11 @@ class User(AbstractUser):
 
     # Add any additional fields you need
 
+    def is_verified(self):
+        """Whether the user has passed KYC."""
+        profile = getattr(self, 'userprofile', None)
+        return profile is not None and profile.kyc_status == 'approved'
+
     def __str__(self):
         return self.username
 
@@ -63,36 +73,206 @@ class Transaction(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=True)
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPE_CHOICES)
     amount = models.DecimalField(max_digits=12, decimal_places=2)
-    external_transaction_id = models.CharField(max_length=255, blank=True, null=True)
+    external_transaction_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    # Name of the provider (see app/providers.py) that the external id belongs to.
+    provider = models.CharField(max_length=50, blank=True, null=True)
+    # Hash of the Stellar transaction that pays this row out (see app/payouts.py).
+    payout_hash = models.CharField(max_length=64, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     description = models.TextField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Matches the keyset ordering used by the transaction history endpoint.
+            models.Index(fields=['user', '-created_at', 'id'], name='txn_user_created_id_idx'),
+            # Keyset scan of pending rows by the reconcile_pending sweeper.
+            models.Index(fields=['status', 'created_at', 'id'], name='txn_status_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.transaction_type} - {self.status}"
 
 
+class USDAccountManager(models.Manager):
+    """
+    Balance mutations as single conditional UPDATE statements.
+
+    The balance is never read into Python and written back, so concurrent
+    credits and debits on the same row cannot lose updates, and only the
+    ``balance`` column is rewritten.
+
+    Accounts with ``shard_count > 0`` keep most of their balance in
+    ``AccountShard`` rows so parallel credits land on different rows; their
+    balance is the account row plus the sum of its shards.
+    """
+
+    def credit(self, user, amount):
+        """Add ``amount`` to the user's balance and return the new balance."""
+        if amount <= 0:
+            raise ValueError("Deposit amount must be positive.")
+        with transaction.atomic():
+            updated = self.filter(user=user, shard_count=0).update(balance=F('balance') + amount)
+            if not updated:
+                shard_count = self._shard_count(user)
+                updated = shard_count and AccountShard.objects.filter(
+                    account_id=_user_key(user), index=random.randrange(shard_count)
+                ).update(balance=F('balance') + amount)
+            if not updated:
+                # The shard is gone: the account was resharded or unsharded
+                # since we read its shard count. The account row always
+                # counts towards the balance, so credit it instead.
+                if not self.filter(user=user).update(balance=F('balance') + amount):
+                    raise self.model.DoesNotExist("USD account not found")
+            self._changed(user)
+            return self._read_balance(user)
+
+    def debit(self, user, amount):
+        """
+        Subtract ``amount`` from the user's balance and return the new balance.
+
+        The ``balance >= amount`` guard is part of the UPDATE itself, so the
+        row is either debited or left untouched; no prior read is needed.
+        """
+        if amount <= 0:
+            raise ValueError("Withdrawal amount must be positive.")
+        with transaction.atomic():
+            updated = self.filter(user=user, shard_count=0, balance__gte=amount).update(balance=F('balance') - amount)
+            if not updated:
+                # Lock the account row so the shard layout cannot change under
+                # us; set_shard_count() takes the same lock first. Debits of a
+                # sharded account serialize here, credits still spread out.
+                shard_count = self._shard_count(user, lock=True)
+                if not shard_count:
+                    raise ValueError("Insufficient balance")
+                self._debit_shards(user, shard_count, amount)
+            self._changed(user)
+            return self._read_balance(user)
+
+    def credit_many(self, amounts, batch_size=500):
+        """
+        Credit several accounts with set-based UPDATEs.
+
+        ``amounts`` maps user ids to the amount to add. Each batch is one
+        ``UPDATE ... SET balance = balance + CASE user_id WHEN ...`` statement;
+        credits land on the account row even for sharded accounts, which is
+        still correct because their total includes the row.
+        """
+        items = sorted(amounts.items())
+        if any(amount <= 0 for _, amount in items):
+            raise ValueError("Deposit amount must be positive.")
+        with transaction.atomic():
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                delta = Case(
+                    *[When(user_id=user_id, then=Value(amount)) for user_id, amount in batch],
+                    output_field=models.DecimalField(max_digits=12, decimal_places=2)
+                )
+                updated = self.filter(user_id__in=[user_id for user_id, _ in batch]).update(
+                    balance=F('balance') + delta)
+                if updated != len(batch):
+                    raise self.model.DoesNotExist("USD account not found")
+            for user_id, _ in items:
+                self._changed(user_id)
+
+    def balance_of(self, user):
+        """Current balance of the user's account."""
+        balance, shard_count = self.filter(user=user).values_list('balance', 'shard_count').get()
+        if shard_count:
+            balance += AccountShard.objects.filter(account_id=_user_key(user)).aggregate(
+                total=Sum('balance'))['total'] or 0
+        return balance
+
+    def set_shard_count(self, user, shard_count):
+        """
+        Split the user's balance across ``shard_count`` sub-balance rows.
+
+        Shards beyond the new count, or all of them for ``0``, are folded
+        back into the account row.
+        """
+        with transaction.atomic():
+            account = self.select_for_update().get(user=user)
+            shards = list(AccountShard.objects.select_for_update().filter(account_id=account.user_id)
+                          .order_by('index'))
+            retired = [shard for shard in shards if shard.index >= shard_count]
+            balance = account.balance + sum((shard.balance for shard in retired), Decimal('0'))
+            AccountShard.objects.filter(pk__in=[shard.pk for shard in retired]).delete()
+            AccountShard.objects.bulk_create([
+                AccountShard(account_id=account.user_id, index=index)
+                for index in range(len(shards) - len(retired), shard_count)
+            ])
+            if shard_count:
+                AccountShard.objects.filter(account_id=account.user_id, index=0).update(
+                    balance=F('balance') + balance)
+                balance = Decimal('0')
+            self.filter(pk=account.pk).update(balance=balance, shard_count=shard_count)
+            self._changed(account.user_id)
+
+    def _shard_count(self, user, lock=False):
+        queryset = self.select_for_update() if lock else self
+        shard_count = queryset.filter(user=user).values_list('shard_count', flat=True).first()
+        if shard_count is None:
+            raise self.model.DoesNotExist("USD account not found")
+        return shard_count
+
+    def _debit_shards(self, user, shard_count, amount):
+        # Fast path: one randomly chosen shard covers the whole amount.
+        if AccountShard.objects.filter(
+            account_id=_user_key(user), index=random.randrange(shard_count), balance__gte=amount
+        ).update(balance=F('balance') - amount):
+            return
+
+        # Sweep: with the account row locked, lock every shard in index order
+        # and draw from the fullest rows until the amount is covered.
+        account = self.select_for_update().get(user=user)
+        shards = list(AccountShard.objects.select_for_update().filter(account_id=account.user_id)
+                      .order_by('index'))
+        if account.balance + sum((shard.balance for shard in shards), Decimal('0')) < amount:
+            raise ValueError("Insufficient balance")
+        remaining = amount
+        if account.balance > 0:
+            take = min(remaining, account.balance)
+            self.filter(pk=account.pk).update(balance=F('balance') - take)
+            remaining -= take
+        for shard in sorted(shards, key=lambda shard: shard.balance, reverse=True):
+            if not remaining:
+                break
+            take = min(remaining, shard.balance)
+            if take > 0:
+                AccountShard.objects.filter(pk=shard.pk).update(balance=F('balance') - take)
+                remaining -= take
+
+    def _read_balance(self, user):
+        # Runs inside the mutating transaction, after the UPDATE has taken
+        # the row lock, so it sees exactly the value this statement wrote.
+        return self.balance_of(user)
+
+    @staticmethod
+    def _changed(user):
+        from .balance_cache import balance_cache
+        balance_cache.on_commit(_user_key(user))
+
+
+def _user_key(user):
+    return getattr(user, 'pk', user)
+
+
 class USDAccount(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="usd_account")
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # Store in USD
+    shard_count = models.PositiveSmallIntegerField(default=0)  # 0 = balance lives on this row only
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = USDAccountManager()
+
     def deposit(self, amount):
         """Credit account with deposit"""
-        if amount <= 0:
-            raise ValueError("Deposit amount must be positive.")
-        self.balance += amount
-        self.save()
+        self.balance = USDAccount.objects.credit(self.user_id, amount)
 
     def withdraw(self, amount):
         """Debit account with withdrawal"""
-        if amount <= 0:
-            raise ValueError("Withdrawal amount must be positive.")
-        if amount > self.balance:
-            raise ValueError("Insufficient balance")
-        self.balance -= amount
-        self.save()
+        self.balance = USDAccount.objects.debit(self.user_id, amount)
 
     def get_transaction_history(self):
         """Retrieve all transactions for the user's account."""
@@ -100,3 +280,198 @@ class USDAccount(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - Balance: ${self.balance}"
+
+
+class AccountShard(models.Model):
+    """Sub-balance of a sharded ``USDAccount``; see ``USDAccountManager``."""
+    account = models.ForeignKey(USDAccount, to_field='user', on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'index'], name='unique_account_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} [{self.index}] - ${self.balance}"
+
+
+class Posting(models.Model):
+    """
+    One leg of a double-entry ledger record. Postings are append-only: every
+    balance change inserts debit and credit legs that sum to zero, and the
+    rows are never updated afterwards.
+
+    ``account`` is keyed on the account's user so callers that only hold a
+    user need no extra lookup; a null account is the platform clearing
+    account, the counterparty for money entering or leaving the platform.
+    """
+    SIDE_CHOICES = [
+        ('debit', 'Debit'),
+        ('credit', 'Credit')
+    ]
+
+    transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, related_name='postings')
+    account = models.ForeignKey(USDAccount, to_field='user', on_delete=models.PROTECT, null=True, blank=True,
+                                related_name='postings')
+    side = models.CharField(max_length=6, choices=SIDE_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'id'], name='posting_account_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Postings are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.side} {self.amount} ({self.transaction_id})"
+
+
+class BalanceSnapshot(models.Model):
+    """Balance of an account including every posting up to ``posting_id``."""
+    account = models.ForeignKey(USDAccount, to_field='user', on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='snapshots')
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    posting_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-posting_id'], name='snapshot_account_cursor_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} - ${self.balance} @ {self.posting_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a request made with an ``Idempotency-Key`` header.
+
+    ``response_status`` is null while the first request is still running;
+    ``locked_at`` is when that request took the key, so a reservation left
+    behind by a crashed worker can be taken over once it is stale.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    locked_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.endpoint} - {self.key}"
+
+
+class CallbackInbox(models.Model):
+    """Anchor callback persisted on receipt and processed later by ``process_callbacks``."""
+    KIND_CHOICES = [
+        ('deposit', 'Deposit'),
+        ('withdrawal', 'Withdrawal')
+    ]
+
+    STATE_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('duplicate', 'Duplicate'),
+        ('failed', 'Failed')
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    external_transaction_id = models.CharField(max_length=255)
+    payload = models.JSONField()
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'id'], name='callback_inbox_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} callback {self.external_transaction_id} - {self.state}"
+
+
+class OutboxMessage(models.Model):
+    """
+    Anchor call queued in the same database transaction as its ``Transaction``.
+
+    ``dispatch_outbox`` sends due messages and writes the anchor's response
+    back; failed sends are retried at ``next_attempt_at`` with backoff.
+    ``lease_token`` identifies the dispatcher holding the current claim.
+    """
+    OPERATION_CHOICES = [
+        ('deposit', 'Deposit'),
+        ('withdrawal', 'Withdrawal')
+    ]
+
+    STATE_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed')
+    ]
+
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='outbox_messages')
+    operation = models.CharField(max_length=20, choices=OPERATION_CHOICES)
+    payload = models.JSONField(default=dict)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    lease_token = models.UUIDField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.operation} for {self.transaction_id} - {self.state}"
+
+
+class StreamCursor(models.Model):
+    """Last processed paging token of a Horizon stream, so listeners resume where they stopped."""
+    name = models.CharField(max_length=100, unique=True)
+    cursor = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.cursor}"
+
+
+class WebhookEvent(models.Model):
+    """A provider webhook that was verified and applied; its id rejects redeliveries."""
+    provider = models.CharField(max_length=50)
+    event_id = models.CharField(max_length=255)
+    external_transaction_id = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=20, null=True, blank=True)  # Normalized; null while not final
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='unique_webhook_event'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} event {self.event_id}"
@@ -0,0 +1,115 @@
+"""
+Dispatcher for the anchor-call outbox.
+
+Messages are claimed with a short lease so several dispatcher processes can
+run side by side, sent to the anchor concurrently from a thread pool, and
+their outcomes written back in the claiming process. Sends that fail are
+retried with exponential backoff and full jitter; once a message runs out
+of attempts its transaction is failed, which refunds withdrawals.
+
+Each claim carries a fresh lease token. A dispatcher that overran its lease
+(and so may have had its messages claimed again) only writes an outcome
+back while the token on the message is still its own.
+"""
+import logging
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from .models import OutboxMessage, Transaction
+from .transact import settle_transactions
+
+logger = logging.getLogger(__name__)
+
+
+def claim(batch_size=50, lease=None):
+    """Lease up to ``batch_size`` due messages to this dispatcher."""
+    if lease is None:
+        lease = getattr(settings, 'OUTBOX_LEASE', timedelta(minutes=2))
+    now = timezone.now()
+    with db_transaction.atomic():
+        pks = list(OutboxMessage.objects.select_for_update(skip_locked=True)
+                   .filter(state='pending', next_attempt_at__lte=now)
+                   .order_by('next_attempt_at')
+                   .values_list('pk', flat=True)[:batch_size])
+        OutboxMessage.objects.filter(pk__in=pks).update(next_attempt_at=now + lease, lease_token=uuid.uuid4())
+    return list(OutboxMessage.objects.select_related('transaction__user').filter(pk__in=pks))
+
+
+def send(message, anchor_service):
+    """Make the anchor call for ``message``; returns ``(response, error)``."""
+    net_amount = Decimal(message.payload['net_amount'])
+    user = message.transaction.user
+    try:
+        if message.operation == 'deposit':
+            response = anchor_service.initiate_deposit(user, net_amount)
+        else:
+            response = anchor_service.initiate_withdrawal(user, net_amount)
+    except Exception as e:
+        logger.warning(f"Anchor {message.operation} call for {message.transaction_id} raised: {e}")
+        return None, str(e)
+    if not isinstance(response, dict) or 'error' in response:
+        return None, str(response.get('error') if isinstance(response, dict) else response)
+    return response, None
+
+
+def record(message, response, error):
+    """Write the outcome of ``send()`` back to the message and its transaction, if we still hold its lease."""
+    held = OutboxMessage.objects.filter(pk=message.pk, state='pending', lease_token=message.lease_token)
+    if error is None:
+        with db_transaction.atomic():
+            if not held.update(state='sent', attempts=message.attempts + 1, response=response, last_error=None,
+                               updated_at=timezone.now()):
+                return _lost_lease(message)
+            Transaction.objects.filter(pk=message.transaction_id).update(
+                external_transaction_id=response.get('id'), updated_at=timezone.now())
+        return
+
+    attempts = message.attempts + 1
+    if attempts >= getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8):
+        logger.error(f"Giving up on anchor {message.operation} for {message.transaction_id}: {error}")
+        with db_transaction.atomic():
+            if not held.update(state='failed', attempts=attempts, last_error=error, updated_at=timezone.now()):
+                return _lost_lease(message)
+            settle_transactions({message.transaction_id: 'failed'})
+        return
+
+    if not held.update(attempts=attempts, last_error=error, next_attempt_at=timezone.now() + backoff(attempts),
+                       updated_at=timezone.now()):
+        _lost_lease(message)
+
+
+def _lost_lease(message):
+    logger.warning(f"Lease on outbox message {message.pk} expired before its outcome was recorded; dropping it")
+
+
+def more_info_url(transaction):
+    """The anchor's interactive URL for ``transaction`` once its call was sent, else ``None``."""
+    response = (OutboxMessage.objects.filter(transaction=transaction, state='sent')
+                .values_list('response', flat=True).first())
+    if not isinstance(response, dict):
+        return None
+    return response.get('url') or response.get('more_info_url')
+
+
+def backoff(attempts):
+    """Full-jitter exponential backoff for the given attempt number."""
+    base = getattr(settings, 'OUTBOX_BACKOFF_BASE', 2.0)
+    cap = getattr(settings, 'OUTBOX_BACKOFF_MAX', 300.0)
+    return timedelta(seconds=random.uniform(0, min(cap, base * 2 ** attempts)))
+
+
+def dispatch(anchor_service, executor, batch_size=50):
+    """Claim, send and record one batch; returns how many messages were handled."""
+    messages = claim(batch_size)
+    if not messages:
+        return 0
+    outcomes = executor.map(lambda message: send(message, anchor_service), messages)
+    for message, (response, error) in zip(messages, outcomes):
+        record(message, response, error)
+    return len(messages)
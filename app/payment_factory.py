@@ -1,48 +1,150 @@
-from app.payment_services import (
-    FlutterwaveAnchorBridge,
-    TempoAnchorBridge,
-    CircleAnchorBridge,
-    SettleNetworkAnchorBridge,
-    AlchemyPayAnchorBridge,
-    MoneyGramAnchorBridge,
-    StellarAnchorService,
-)
-
-
-def get_anchor_url_for_service(service_class) -> str:
-    """Get the anchor URL for the specified payment service class."""
-    anchor_urls = {
-        FlutterwaveAnchorBridge: "https://flutterwave.com/api",
-        TempoAnchorBridge: "https://tempo.com/api",
-        CircleAnchorBridge: "https://circle.com/api",
-        SettleNetworkAnchorBridge: "https://settlenetwork.com/api",
-        AlchemyPayAnchorBridge: "https://alchemy.com/api",
-        MoneyGramAnchorBridge: "https://moneygram.com/api",
-    }
-
-    return anchor_urls.get(service_class, "https://default.anchor.com/api")
+import logging
+import time
+
+from django.conf import settings
+
+from app import providers
+from app.circuit_breaker import breaker_for
+
+logger = logging.getLogger(__name__)
+
+# Providers to try for each region, in order of preference. Regions are the
+# UserProfile region codes; the long names are kept for existing callers.
+DEFAULT_ROUTES = {
+    "AF": ["flutterwave", "alchemypay", "moneygram"],
+    "EU": ["tempo", "alchemypay", "moneygram"],
+    "US": ["circle", "alchemypay", "moneygram"],
+    "LATAM": ["settle_network", "alchemypay", "moneygram"],
+    "Africa": ["flutterwave", "alchemypay", "moneygram"],
+    "Europe": ["tempo", "alchemypay", "moneygram"],
+    "South America": ["settle_network", "alchemypay", "moneygram"],
+    "Global": ["alchemypay", "moneygram"],
+    "Global_MoneyGram": ["moneygram", "alchemypay"],
+}
+DEFAULT_PROVIDER = providers.STELLAR
+
+
+class MonitoredService:
+    """
+    Wraps a payment service so every call feeds its provider's circuit
+    breaker, and calls fail fast with an error while the breaker is open.
+
+    A call counts as failed if it raises or returns an ``'error'``. A call
+    that is cancelled (or otherwise interrupted) records nothing, but still
+    gives back a half-open breaker's trial slot.
+    """
+
+    def __init__(self, name, service):
+        self.name = name
+        self.service = service
+
+    @property
+    def breaker(self):
+        return breaker_for(self.name)
+
+    def initiate_deposit(self, user, amount):
+        return self._call(self.service.initiate_deposit, user, amount)
+
+    def initiate_withdrawal(self, user, amount):
+        return self._call(self.service.initiate_withdrawal, user, amount)
+
+    def check_transaction_status(self, transaction_id):
+        return self._call(self.service.check_transaction_status, transaction_id)
+
+    async def ainitiate_deposit(self, user, amount):
+        return await self._acall(self.service.ainitiate_deposit, user, amount)
+
+    async def ainitiate_withdrawal(self, user, amount):
+        return await self._acall(self.service.ainitiate_withdrawal, user, amount)
+
+    async def acheck_transaction_status(self, transaction_id):
+        return await self._acall(self.service.acheck_transaction_status, transaction_id)
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def _call(self, method, *args):
+        if not self.breaker.allow():
+            return self._unavailable()
+        started = time.monotonic()
+        ok = None
+        try:
+            result = method(*args)
+            ok = _succeeded(result)
+            return result
+        except Exception:
+            ok = False
+            raise
+        finally:
+            self._settle(ok, started)
+
+    async def _acall(self, method, *args):
+        if not self.breaker.allow():
+            return self._unavailable()
+        started = time.monotonic()
+        ok = None
+        try:
+            result = await method(*args)
+            ok = _succeeded(result)
+            return result
+        except Exception:
+            ok = False
+            raise
+        finally:
+            self._settle(ok, started)
+
+    def _settle(self, ok, started):
+        if ok is None:
+            # Cancelled before an outcome; don't leave the trial slot taken.
+            self.breaker.release()
+        else:
+            self.breaker.record(ok, time.monotonic() - started)
+
+    def _unavailable(self):
+        logger.warning(f"Circuit open for {self.name}; failing fast")
+        return {"error": f"Payment provider {self.name} is temporarily unavailable"}
+
+
+def _succeeded(result):
+    return not (isinstance(result, dict) and 'error' in result)
 
 
 class PaymentFactory:
     """Factory for creating payment service instances based on user region."""
 
+    @staticmethod
+    def routes_for(user_region: str):
+        routes = {**DEFAULT_ROUTES, **getattr(settings, 'PAYMENT_ROUTES', {})}
+        return routes.get(user_region, [DEFAULT_PROVIDER])
+
     @staticmethod
     def get_payment_service(user_region: str):
-        """Retrieve the appropriate payment service based on user region."""
-        anchor_services = {
-            "Africa": FlutterwaveAnchorBridge,
-            "Europe": TempoAnchorBridge,
-            "US": CircleAnchorBridge,
-            "South America": SettleNetworkAnchorBridge,
-            "Global": AlchemyPayAnchorBridge,
-            "Global_MoneyGram": MoneyGramAnchorBridge,
-        }
-
-        # Get the service class based on user region, defaulting to Stellar
-        service_class = anchor_services.get(user_region, StellarAnchorService)
-
-        # Retrieve the anchor URL based on the selected service
-        anchor_url = get_anchor_url_for_service(service_class)
-
-        # Return an instance of the selected service with the anchor URL
-        return service_class(anchor_url)
+        """
+        Retrieve the payment service for the user's region.
+
+        The first provider on the region's route whose circuit breaker is not
+        open is used. If every breaker is open, the primary is returned and
+        fails fast until it recovers.
+        """
+        route = PaymentFactory.routes_for(user_region)
+        name = next((name for name in route if breaker_for(name).available()), route[0])
+        if name != route[0]:
+            logger.info(f"Routing {user_region} to {name}; {route[0]} is unavailable")
+        return MonitoredService(name, providers.get(name))
+
+    @staticmethod
+    def get_status_service(user_region: str, provider: str = None):
+        """
+        Retrieve the service to ask about an existing transaction.
+
+        That is the provider holding it (``Transaction.provider``), or the
+        region's primary when that is unknown. There is no failover: no
+        other provider knows the transaction, so while the breaker is open
+        the call fails fast instead. Returns ``None`` when the provider has
+        no status service, e.g. ``'stellar_payout'`` rows written before
+        payouts kept their hash in ``Transaction.payout_hash``.
+        """
+        name = provider or PaymentFactory.routes_for(user_region)[0]
+        if name not in providers.NAMES:
+            return None
+        return MonitoredService(name, providers.get(name))
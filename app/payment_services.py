@@ -1,9 +1,19 @@
+import asyncio
+import contextvars
+import logging
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
 
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from stellar_sdk import Server, Keypair, Network
 
+from . import sep10
+from .transport import session_for, async_client_for, horizon_client
+
+logger = logging.getLogger(__name__)
+
 
 class PaymentService(ABC):
     @abstractmethod
@@ -18,40 +28,75 @@ class PaymentService(ABC):
     def check_transaction_status(self, transaction_id):
         pass
 
+    # Async variants for ASGI views. By default they run the blocking method
+    # in a worker thread; services with a native async client override them.
+
+    async def ainitiate_deposit(self, user, amount):
+        return await sync_to_async(self.initiate_deposit, thread_sensitive=False)(user, amount)
+
+    async def ainitiate_withdrawal(self, user, amount):
+        return await sync_to_async(self.initiate_withdrawal, thread_sensitive=False)(user, amount)
+
+    async def acheck_transaction_status(self, transaction_id):
+        return await sync_to_async(self.check_transaction_status, thread_sensitive=False)(transaction_id)
+
 
 class StellarAnchorService(PaymentService):
     def __init__(self):
         self.network = Network.PUBLIC_NETWORK_PASSPHRASE
-        self.server = Server("https://horizon.stellar.org")
+        self.server = Server(settings.STELLAR_HORIZON_URL, client=horizon_client())
         self.platform_keypair = Keypair.from_secret(settings.STELLAR_PLATFORM_SECRET)
         self.anchor_url = settings.ANCHOR_URL
+        self.http = session_for('stellar_anchor')
         self.asset_code = "USDC"
         self.asset_issuer = settings.USDC_ISSUER_PUBLIC_KEY
 
     def initiate_deposit(self, user, amount):
-        fee_percentage = settings.DEPOSIT_FEE_PERCENTAGE
-        fee = amount * (fee_percentage / 100)
-        net_amount = amount - fee
-
-        jwt_token = self.get_auth_token(user)
-        headers = {
-            "Authorization": f"Bearer {jwt_token}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "asset_code": self.asset_code,
-            "account": self.platform_keypair.public_key,
-            "net_amount": str(net_amount)
-        }
-        response = requests.post(f"{self.anchor_url}/transactions/deposit/interactive", headers=headers, json=data)
+        headers, data = self._interactive_request(self.get_auth_token(user), amount)
+        response = self.http.post(f"{self.anchor_url}/transactions/deposit/interactive", headers=headers, json=data)
         return response.json() if response.status_code == 200 else {"error": "Failed to initiate deposit"}
 
     def initiate_withdrawal(self, user, amount):
-        fee_percentage = settings.DEPOSIT_FEE_PERCENTAGE
-        fee = amount * (fee_percentage / 100)
-        net_amount = amount - fee
+        headers, data = self._interactive_request(self.get_auth_token(user), amount)
+        response = self.http.post(f"{self.anchor_url}/transactions/withdraw/interactive", headers=headers, json=data)
+        return response.json() if response.status_code == 200 else {"error": "Failed to initiate withdrawal"}
+
+    def check_transaction_status(self, transaction_id):
+        jwt_token = self.get_auth_token(None)
+        headers = {"Authorization": f"Bearer {jwt_token}"}
+        response = self.http.get(f"{self.anchor_url}/transaction/{transaction_id}", headers=headers)
+        return response.json() if response.status_code == 200 else {"error": "Failed to check transaction status"}
+
+    async def ainitiate_deposit(self, user, amount):
+        client = async_client_for('stellar_anchor')
+        if client is None:
+            return await super().ainitiate_deposit(user, amount)
+        headers, data = self._interactive_request(await self.aget_auth_token(user), amount)
+        response = await client.post(f"{self.anchor_url}/transactions/deposit/interactive", headers=headers,
+                                     json=data)
+        return response.json() if response.status_code == 200 else {"error": "Failed to initiate deposit"}
 
-        jwt_token = self.get_auth_token(user)
+    async def ainitiate_withdrawal(self, user, amount):
+        client = async_client_for('stellar_anchor')
+        if client is None:
+            return await super().ainitiate_withdrawal(user, amount)
+        headers, data = self._interactive_request(await self.aget_auth_token(user), amount)
+        response = await client.post(f"{self.anchor_url}/transactions/withdraw/interactive", headers=headers,
+                                     json=data)
+        return response.json() if response.status_code == 200 else {"error": "Failed to initiate withdrawal"}
+
+    async def acheck_transaction_status(self, transaction_id):
+        client = async_client_for('stellar_anchor')
+        if client is None:
+            return await super().acheck_transaction_status(transaction_id)
+        jwt_token = await self.aget_auth_token(None)
+        headers = {"Authorization": f"Bearer {jwt_token}"}
+        response = await client.get(f"{self.anchor_url}/transaction/{transaction_id}", headers=headers)
+        return response.json() if response.status_code == 200 else {"error": "Failed to check transaction status"}
+
+    def _interactive_request(self, jwt_token, amount):
+        # ``amount`` is already net of our fee; DepositService and
+        # WithdrawalService quote it once, when the request comes in.
         headers = {
             "Authorization": f"Bearer {jwt_token}",
             "Content-Type": "application/json"
@@ -59,27 +104,109 @@ class StellarAnchorService(PaymentService):
         data = {
             "asset_code": self.asset_code,
             "account": self.platform_keypair.public_key,
-            "net_amount": str(net_amount)
+            "net_amount": str(amount)
         }
-        response = requests.post(f"{self.anchor_url}/transactions/withdraw/interactive", headers=headers, json=data)
-        return response.json() if response.status_code == 200 else {"error": "Failed to initiate withdrawal"}
-
-    def check_transaction_status(self, transaction_id):
-        jwt_token = self.get_auth_token(None)  # You might need to adjust this depending on your auth strategy
-        headers = {"Authorization": f"Bearer {jwt_token}"}
-        response = requests.get(f"{self.anchor_url}/transaction/{transaction_id}", headers=headers)
-        return response.json() if response.status_code == 200 else {"error": "Failed to check transaction status"}
+        return headers, data
 
     def get_auth_token(self, user):
-        # Implement your authentication logic here
-        # This should return a JWT token that the anchor will use to authenticate the request
-        pass
+        # SEP-10 token for the platform account; the user's id goes in the
+        # memo so the anchor can tell users of the shared account apart.
+        memo = user.pk if user is not None else None
+        return sep10.get_token(sep10.auth_url(self.anchor_url), self.platform_keypair, self.network, memo,
+                               anchor_url=self.anchor_url)
+
+    async def aget_auth_token(self, user):
+        memo = user.pk if user is not None else None
+        token = sep10.token_cache.peek(sep10.cache_key(sep10.auth_url(self.anchor_url), self.platform_keypair, memo))
+        if token is not None:
+            return token
+        return await sync_to_async(self.get_auth_token, thread_sensitive=False)(user)
+
+
+class AnchorBridge(PaymentService):
+    """
+    A fiat provider paired with the Stellar anchor.
+
+    Status checks query every leg concurrently under one deadline
+    (``BRIDGE_STATUS_TIMEOUT`` seconds), so they take as long as the slowest
+    leg rather than the sum. A leg that fails or misses the deadline comes
+    back as ``None`` with its reason under ``'errors'``. Threaded legs run
+    in a copy of the caller's context, so their provider time is attributed
+    to the request that asked (see ``metrics``).
+    """
 
+    @abstractmethod
+    def status_legs(self):
+        """Map each result key to the service whose status it holds."""
 
-class FlutterwaveAnchorBridge(PaymentService):
-    def __init__(self):
+    def check_transaction_status(self, transaction_id):
+        legs = self.status_legs()
+        futures = {key: _status_executor().submit(contextvars.copy_context().run,
+                                                  service.check_transaction_status, transaction_id)
+                   for key, service in legs.items()}
+        wait(futures.values(), timeout=_status_timeout())
+
+        results, errors = {}, {}
+        for key, future in futures.items():
+            # A leg still running past the deadline is abandoned, not cancelled;
+            # it finishes in the background and its result is dropped.
+            results[key], errors[key] = _leg_outcome(future)
+        return _status_response(results, errors)
+
+    async def acheck_transaction_status(self, transaction_id):
+        legs = self.status_legs()
+        tasks = {key: asyncio.ensure_future(service.acheck_transaction_status(transaction_id))
+                 for key, service in legs.items()}
+        await asyncio.wait(tasks.values(), timeout=_status_timeout())
+
+        results, errors = {}, {}
+        for key, task in tasks.items():
+            if not task.done():
+                task.cancel()
+            results[key], errors[key] = _leg_outcome(task)
+        return _status_response(results, errors)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _status_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'BRIDGE_STATUS_WORKERS', 32),
+                                               thread_name_prefix='bridge-status')
+    return _executor
+
+
+def _status_timeout():
+    return getattr(settings, 'BRIDGE_STATUS_TIMEOUT', 10.0)
+
+
+def _leg_outcome(future):
+    """``(result, error)`` for a finished or abandoned leg; works for threads and tasks alike."""
+    if not future.done() or future.cancelled():
+        return None, f'timed out after {_status_timeout()}s'
+    exception = future.exception()
+    if exception is not None:
+        logger.warning("Bridge status leg failed: %r", exception)
+        return None, str(exception) or exception.__class__.__name__
+    return future.result(), None
+
+
+def _status_response(results, errors):
+    errors = {key: error for key, error in errors.items() if error is not None}
+    if errors:
+        results['errors'] = errors
+    return results
+
+
+class FlutterwaveAnchorBridge(AnchorBridge):
+    def __init__(self, stellar_service=None):
         self.flutterwave_service = FlutterwaveService()
-        self.stellar_service = StellarAnchorService()
+        self.stellar_service = stellar_service or StellarAnchorService()
 
     def initiate_deposit(self, user, amount):
         # First, initiate the deposit with Flutterwave
@@ -115,21 +242,18 @@ class FlutterwaveAnchorBridge(PaymentService):
             'flutterwave_response': flutterwave_response
         }
 
-    def check_transaction_status(self, transaction_id):
+    def status_legs(self):
         # Check status with both Flutterwave and Stellar
-        flutterwave_status = self.flutterwave_service.check_transaction_status(transaction_id)
-        stellar_status = self.stellar_service.check_transaction_status(transaction_id)
-
         return {
-            'flutterwave_status': flutterwave_status,
-            'stellar_status': stellar_status
+            'flutterwave_status': self.flutterwave_service,
+            'stellar_status': self.stellar_service,
         }
 
 
-class TempoAnchorBridge(PaymentService):
-    def __init__(self):
+class TempoAnchorBridge(AnchorBridge):
+    def __init__(self, stellar_service=None):
         self.tempo_service = TempoService()
-        self.stellar_service = StellarAnchorService()
+        self.stellar_service = stellar_service or StellarAnchorService()
 
     def initiate_deposit(self, user, amount):
         # First, initiate the deposit with Tempo
@@ -165,21 +289,18 @@ class TempoAnchorBridge(PaymentService):
             'tempo_response': tempo_response
         }
 
-    def check_transaction_status(self, transaction_id):
+    def status_legs(self):
         # Check status with both Tempo and Stellar
-        tempo_status = self.tempo_service.check_transaction_status(transaction_id)
-        stellar_status = self.stellar_service.check_transaction_status(transaction_id)
-
         return {
-            'tempo_status': tempo_status,
-            'stellar_status': stellar_status
+            'tempo_status': self.tempo_service,
+            'stellar_status': self.stellar_service,
         }
 
 
-class CircleAnchorBridge(PaymentService):
-    def __init__(self):
+class CircleAnchorBridge(AnchorBridge):
+    def __init__(self, stellar_service=None):
         self.circle_service = CircleService()
-        self.stellar_service = StellarAnchorService()
+        self.stellar_service = stellar_service or StellarAnchorService()
 
     def initiate_deposit(self, user, amount):
         # First, initiate the deposit with Circle
@@ -215,21 +336,18 @@ class CircleAnchorBridge(PaymentService):
             'circle_response': circle_response
         }
 
-    def check_transaction_status(self, transaction_id):
+    def status_legs(self):
         # Check status with both Circle and Stellar
-        circle_status = self.circle_service.check_transaction_status(transaction_id)
-        stellar_status = self.stellar_service.check_transaction_status(transaction_id)
-
         return {
-            'circle_status': circle_status,
-            'stellar_status': stellar_status
+            'circle_status': self.circle_service,
+            'stellar_status': self.stellar_service,
         }
 
 
-class SettleNetworkAnchorBridge(PaymentService):
-    def __init__(self):
-        self.SettleNetwork = SettleNetworkService()
-        self.stellar_service = StellarAnchorService()
+class SettleNetworkAnchorBridge(AnchorBridge):
+    def __init__(self, stellar_service=None):
+        self.SettleNetwork_service = SettleNetworkService()
+        self.stellar_service = stellar_service or StellarAnchorService()
 
     def initiate_deposit(self, user, amount):
         # First, initiate the deposit with Tempo
@@ -264,21 +382,18 @@ class SettleNetworkAnchorBridge(PaymentService):
             'SettleNetwork_response': SettleNetwork_response
         }
 
-    def check_transaction_status(self, transaction_id):
-        # Check status with both Tempo and Stellar
-        SettleNetwork_status = self.SettleNetwork_service.check_transaction_status(transaction_id)
-        stellar_status = self.stellar_service.check_transaction_status(transaction_id)
-
+    def status_legs(self):
+        # Check status with both SettleNetwork and Stellar
         return {
-            'tempo_status': SettleNetwork_status,
-            'stellar_status': stellar_status
+            'SettleNetwork_status': self.SettleNetwork_service,
+            'stellar_status': self.stellar_service,
         }
 
 
-class AlchemyPayAnchorBridge(PaymentService):
-    def __init__(self):
+class AlchemyPayAnchorBridge(AnchorBridge):
+    def __init__(self, stellar_service=None):
         self.AlchemyPay_service = AlchemyPayService()
-        self.stellar_service = StellarAnchorService()
+        self.stellar_service = stellar_service or StellarAnchorService()
 
     def initiate_deposit(self, user, amount):
         # First, initiate the deposit with Circle
@@ -304,7 +419,7 @@ class AlchemyPayAnchorBridge(PaymentService):
             return stellar_response
 
         # If Stellar withdrawal is successful, initiate the withdrawal with Circle
-        AlchemyPay_response = self.circle_service.initiate_withdrawal(user, amount)
+        AlchemyPay_response = self.AlchemyPay_service.initiate_withdrawal(user, amount)
         if 'error' in AlchemyPay_response:
             # Optionally cancel the Stellar transaction here
             return AlchemyPay_response
@@ -314,21 +429,18 @@ class AlchemyPayAnchorBridge(PaymentService):
             'circle_response': AlchemyPay_response
         }
 
-    def check_transaction_status(self, transaction_id):
-        # Check status with both Circle and Stellar
-        AlchemyPay_status = self.AlchemyPay_service.check_transaction_status(transaction_id)
-        stellar_status = self.stellar_service.check_transaction_status(transaction_id)
-
+    def status_legs(self):
+        # Check status with both AlchemyPay and Stellar
         return {
-            'AlchemyPay_status': AlchemyPay_status,
-            'stellar_status': stellar_status
+            'AlchemyPay_status': self.AlchemyPay_service,
+            'stellar_status': self.stellar_service,
         }
 
 
-class MoneyGramAnchorBridge(PaymentService):
-    def __init__(self):
+class MoneyGramAnchorBridge(AnchorBridge):
+    def __init__(self, stellar_service=None):
         self.MoneyGram_service = MoneyGramService()
-        self.stellar_service = StellarAnchorService()
+        self.stellar_service = stellar_service or StellarAnchorService()
 
     def initiate_deposit(self, user, amount):
         # First, initiate the deposit with Monwygram
@@ -364,14 +476,11 @@ class MoneyGramAnchorBridge(PaymentService):
             'MoneyGram_response': MoneyGram_response
         }
 
-    def check_transaction_status(self, transaction_id):
+    def status_legs(self):
         # Check status with both Moneygram and Stellar
-        MoneyGram_status = self.MoneyGram_service.check_transaction_status(transaction_id)
-        stellar_status = self.stellar_service.check_transaction_status(transaction_id)
-
         return {
-            'circle_status': MoneyGram_status,
-            'stellar_status': stellar_status
+            'MoneyGram_status': self.MoneyGram_service,
+            'stellar_status': self.stellar_service,
         }
 
 
@@ -379,8 +488,12 @@ class FlutterwaveService(PaymentService):
     BASE_URL = "https://api.flutterwave.com/v3"
     SECRET_KEY = "YOUR_FLUTTERWAVE_SECRET_KEY"
 
+    def __init__(self):
+        self.base_url = getattr(settings, 'FLUTTERWAVE_API_URL', self.BASE_URL)
+        self.http = session_for('flutterwave')
+
     def initiate_deposit(self, user, amount):
-        url = f"{self.BASE_URL}/payments"
+        url = f"{self.base_url}/payments"
         headers = {
             "Authorization": f"Bearer {self.SECRET_KEY}",
             "Content-Type": "application/json"
@@ -397,7 +510,7 @@ class FlutterwaveService(PaymentService):
             }
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        response = self.http.post(url, headers=headers, json=data)
         return response.json()
 
     def initiate_withdrawal(self, user, amount):
@@ -405,9 +518,9 @@ class FlutterwaveService(PaymentService):
         pass
 
     def check_transaction_status(self, transaction_id):
-        url = f"{self.BASE_URL}/transactions/{transaction_id}/verify"
+        url = f"{self.base_url}/transactions/{transaction_id}/verify"
         headers = {"Authorization": f"Bearer {self.SECRET_KEY}"}
-        response = requests.get(url, headers=headers)
+        response = self.http.get(url, headers=headers)
         return response.json()
 
 
@@ -0,0 +1,107 @@
+"""
+Confirm deposits from the Horizon payment stream of the platform account.
+
+``stream_payments`` feeds Horizon payment records (streamed with
+``join=transactions`` so the memo comes along) to ``apply()`` in batches.
+Incoming payments of the platform asset are matched to pending deposits
+whose ``external_transaction_id`` is the payment's memo or transaction hash.
+A payment only settles its deposit if it is for exactly the amount the
+anchor was asked to deliver (the deposit's net of fees); short and over
+payments are logged and the deposit is left pending for review. Matched
+deposits are settled in one ``settle_transactions`` call, and the
+stream cursor is saved in the same database transaction. After a restart or
+reconnect the stream resumes from the last applied record, and replays do
+nothing because only pending rows are settled.
+"""
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction as db_transaction
+
+from .models import OutboxMessage, StreamCursor, Transaction
+from .transact import settle_transactions
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_TYPES = ('payment', 'path_payment_strict_receive', 'path_payment_strict_send')
+
+
+def load_cursor(name, default='now'):
+    return StreamCursor.objects.filter(name=name).values_list('cursor', flat=True).first() or default
+
+
+def incoming(records, account_id, asset_code, asset_issuer):
+    """The records that pay ``asset_code``/``asset_issuer`` into ``account_id``."""
+    for record in records:
+        if record.get('type') not in PAYMENT_TYPES or record.get('to') != account_id:
+            continue
+        if record.get('asset_code') != asset_code or record.get('asset_issuer') != asset_issuer:
+            continue
+        if not record.get('transaction_successful', True):
+            continue
+        yield record
+
+
+def match_keys(record):
+    keys = []
+    memo = (record.get('transaction') or {}).get('memo')
+    if memo:
+        keys.append(str(memo))
+    if record.get('transaction_hash'):
+        keys.append(record['transaction_hash'])
+    return keys
+
+
+def apply(name, records, account_id, asset_code, asset_issuer):
+    """
+    Settle the deposits paid by ``records`` and advance cursor ``name`` past
+    them, atomically. Returns the settled transactions.
+    """
+    if not records:
+        return []
+    payments = {}
+    for record in incoming(records, account_id, asset_code, asset_issuer):
+        for key in match_keys(record):
+            payments[key] = record
+
+    with db_transaction.atomic():
+        settled = []
+        if payments:
+            deposits = list(Transaction.objects
+                            .filter(external_transaction_id__in=payments, transaction_type='deposit', status='pending')
+                            .values_list('pk', 'external_transaction_id', 'amount'))
+            expected = expected_amounts(deposits)
+            outcomes = {}
+            for pk, external_id, _ in deposits:
+                record = payments[external_id]
+                paid = _amount(record.get('amount'))
+                if paid != expected[pk]:
+                    logger.warning(f"Deposit {pk} paid {record.get('amount')} {asset_code} on-chain by "
+                                   f"{record['transaction_hash']}, expected {expected[pk]}; leaving it for review")
+                    continue
+                logger.info(f"Deposit {pk} paid on-chain by {record['transaction_hash']} ({paid} {asset_code})")
+                outcomes[pk] = 'completed'
+            settled = settle_transactions(outcomes)
+        StreamCursor.objects.update_or_create(name=name, defaults={'cursor': records[-1]['paging_token']})
+    return settled
+
+
+def expected_amounts(deposits):
+    """
+    ``{pk: amount}`` the anchor should pay for each ``(pk, external_id, amount)``:
+    the net amount it was asked to deliver, or the whole amount for deposits
+    that never went through the outbox.
+    """
+    expected = {pk: amount for pk, _, amount in deposits}
+    messages = OutboxMessage.objects.filter(transaction_id__in=expected, operation='deposit')
+    for pk, payload in messages.values_list('transaction_id', 'payload'):
+        if 'net_amount' in payload:
+            expected[pk] = Decimal(payload['net_amount'])
+    return expected
+
+
+def _amount(value):
+    try:
+        return Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
@@ -0,0 +1,182 @@
+"""
+Batched Stellar payouts.
+
+``PayoutBatcher`` collects payouts for up to ``PAYOUT_BATCH_WINDOW``
+seconds, or until ``MAX_OPERATIONS`` are waiting, and pays them in one
+multi-operation transaction: one fee per operation but one submission per
+batch instead of per payout. Batches are submitted in parallel, up to the
+number of channel accounts.
+
+``send_batch()`` pays a list of payouts directly and writes the outcome back
+to their ``Transaction`` rows. The hash of every envelope is written to the
+rows' ``payout_hash`` before it is submitted, so a batch whose outcome is
+unknown can still be looked up on the ledger later, by ``reconcile_pending``
+through ``check_status()``; the anchor's ``external_transaction_id`` is left
+alone. A Stellar transaction is all-or-nothing:
+
+* success completes every row;
+* ``tx_failed`` fails only the operations that failed, and the rest, which
+  were rolled back with them, go out again in a new transaction;
+* any other rejection (4xx) fails every row, since nothing was paid, so
+  withdrawals are refunded through ``settle_transactions``;
+* timeouts, 5xx responses and connection errors after the envelope was
+  handed to Horizon leave the rows pending, since the payment may still
+  have landed;
+* errors before that (no free channel, ``load_account`` failing) fail
+  every row, since nothing can have been paid.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections
+from stellar_sdk.exceptions import BadRequestError, NotFoundError
+
+from . import channels
+from .models import Transaction
+from .transact import settle_transactions
+
+logger = logging.getLogger(__name__)
+
+# Stellar's limit on operations per transaction.
+MAX_OPERATIONS = 100
+# Name the reconciler checks (and rate-limits) rows with a ``payout_hash`` under.
+PROVIDER = 'stellar_payout'
+
+
+@dataclass
+class Payout:
+    transaction_id: object
+    destination: str
+    amount: Decimal
+    future: Future = field(default_factory=Future, compare=False, repr=False)
+
+
+def send_batch(service, payouts):
+    """
+    Pay ``payouts`` (at most ``MAX_OPERATIONS``) in one transaction and settle
+    their rows. Returns ``{transaction_id: status}``, where status is
+    ``'completed'``, ``'failed'`` or ``'pending'``.
+    """
+    outcomes = {}
+    while payouts:
+        transaction_ids = [payout.transaction_id for payout in payouts]
+        recorded = []
+
+        def record_hash(tx_hash):
+            Transaction.objects.filter(pk__in=transaction_ids).update(payout_hash=tx_hash)
+            recorded.append(tx_hash)
+
+        try:
+            response = service.submit_payments([(payout.destination, payout.amount) for payout in payouts],
+                                               before_submit=record_hash)
+        except BadRequestError as e:
+            if channels.result_code(e) != 'tx_failed':
+                logger.warning(f"Payout batch of {len(payouts)} rejected: {channels.result_code(e) or e}")
+                outcomes.update((payout.transaction_id, 'failed') for payout in payouts)
+                break
+            codes = e.extras['result_codes'].get('operations', [])
+            retry = []
+            for index, payout in enumerate(payouts):
+                if index < len(codes) and codes[index] != 'op_success':
+                    logger.warning(f"Payout {payout.transaction_id} failed: {codes[index]}")
+                    outcomes[payout.transaction_id] = 'failed'
+                else:
+                    retry.append(payout)
+            if len(retry) == len(payouts):
+                # No operation was singled out; don't resubmit the same batch forever.
+                outcomes.update((payout.transaction_id, 'failed') for payout in payouts)
+                break
+            payouts = retry
+        except Exception as e:
+            if not recorded:
+                # Nothing was handed to Horizon, so nothing was paid.
+                logger.warning(f"Payout batch of {len(payouts)} failed before submission: {e}")
+                outcomes.update((payout.transaction_id, 'failed') for payout in payouts)
+                break
+            logger.warning(f"Payout batch of {len(payouts)} has an unknown outcome: {e}")
+            outcomes.update((payout.transaction_id, 'pending') for payout in payouts)
+            break
+        else:
+            outcomes.update((payout.transaction_id, 'completed') for payout in payouts)
+            break
+
+    settle_transactions(outcomes)
+    return outcomes
+
+
+def check_status(server, tx_hash):
+    """``'completed'``/``'failed'`` for a submitted payout transaction, or ``None`` while Horizon has no record of it."""
+    try:
+        record = server.transactions().transaction(tx_hash).call()
+    except NotFoundError:
+        return None
+    return 'completed' if record.get('successful') else 'failed'
+
+
+class PayoutBatcher:
+    def __init__(self, service, window=None, max_operations=MAX_OPERATIONS, workers=None):
+        self.service = service
+        self.window = window if window is not None else getattr(settings, 'PAYOUT_BATCH_WINDOW', 0.5)
+        self.max_operations = min(max_operations, MAX_OPERATIONS)
+        workers = workers or channels.channel_pool(service.platform_keypair).size
+        self._pending = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payout-batch')
+        self._closed = threading.Event()
+        self._collector = threading.Thread(target=self._collect, name='payout-collector', daemon=True)
+        self._collector.start()
+
+    def submit(self, transaction_id, destination, amount):
+        """Queue a payout; the returned future resolves to its status."""
+        if self._closed.is_set():
+            raise RuntimeError("PayoutBatcher is closed")
+        payout = Payout(transaction_id, destination, Decimal(str(amount)))
+        self._pending.put(payout)
+        return payout.future
+
+    def close(self):
+        """Send whatever is queued, then stop."""
+        self._closed.set()
+        self._pending.put(None)
+        self._collector.join()
+        self._executor.shutdown(wait=True)
+
+    def _collect(self):
+        while True:
+            first = self._pending.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            stop = False
+            while len(batch) < self.max_operations:
+                try:
+                    payout = self._pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if payout is None:
+                    stop = True
+                    break
+                batch.append(payout)
+            self._executor.submit(self._send, batch)
+            if stop:
+                return
+
+    def _send(self, batch):
+        close_old_connections()
+        try:
+            outcomes = send_batch(self.service, batch)
+        except Exception as e:
+            logger.exception("Payout batch failed")
+            for payout in batch:
+                payout.future.set_exception(e)
+            return
+        finally:
+            close_old_connections()
+        for payout in batch:
+            payout.future.set_result(outcomes[payout.transaction_id])
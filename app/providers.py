@@ -0,0 +1,88 @@
+"""
+Process-wide registry of payment provider instances.
+
+Each provider is constructed once, on first use, and shared by every
+request and thread afterwards. The bridges share the single
+``StellarAnchorService``, so the Horizon client and platform keypair are set
+up once per process. ``warm_up()`` builds the providers listed in
+``PAYMENT_PROVIDERS_WARM_UP`` when the app loads, so the first requests on a
+new worker don't pay for it.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from .payment_services import (
+    FlutterwaveAnchorBridge,
+    TempoAnchorBridge,
+    CircleAnchorBridge,
+    SettleNetworkAnchorBridge,
+    AlchemyPayAnchorBridge,
+    MoneyGramAnchorBridge,
+    StellarAnchorService,
+)
+
+logger = logging.getLogger(__name__)
+
+STELLAR = "stellar"
+
+BRIDGES = {
+    "flutterwave": FlutterwaveAnchorBridge,
+    "tempo": TempoAnchorBridge,
+    "circle": CircleAnchorBridge,
+    "settle_network": SettleNetworkAnchorBridge,
+    "alchemypay": AlchemyPayAnchorBridge,
+    "moneygram": MoneyGramAnchorBridge,
+}
+NAMES = (STELLAR, *BRIDGES)
+
+_instances = {}
+# Reentrant, as building a bridge builds the shared Stellar service too.
+_lock = threading.RLock()
+
+
+def get(name):
+    """Return the shared instance of provider ``name``, constructing it on first use."""
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = _instances[name] = _build(name)
+    return instance
+
+
+def stellar():
+    return get(STELLAR)
+
+
+def warm_up(names=None):
+    """Construct ``names`` (default: ``PAYMENT_PROVIDERS_WARM_UP``) now; failures are logged, not raised."""
+    if names is None:
+        names = getattr(settings, 'PAYMENT_PROVIDERS_WARM_UP', ())
+    for name in names:
+        try:
+            get(name)
+        except Exception:
+            logger.exception(f"Could not warm up payment provider {name}")
+
+
+def reset():
+    with _lock:
+        _instances.clear()
+
+
+def _build(name):
+    if name == STELLAR:
+        return StellarAnchorService()
+    return BRIDGES[name](stellar_service=stellar())
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('STELLAR_PLATFORM_SECRET', 'ANCHOR_URL', 'USDC_ISSUER_PUBLIC_KEY'):
+        reset()
+
+
+setting_changed.connect(_reset_on_setting_change)
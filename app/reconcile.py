@@ -0,0 +1,217 @@
+"""
+Sweep pending transactions and settle the ones their provider has finished.
+
+``Reconciler.run()`` walks pending rows older than ``min_age`` in keyset order
+over the ``(status, created_at, id)`` index, one chunk at a time. For each
+chunk it asks every row's provider for its status (Horizon, by
+``payout_hash``, for Stellar payouts sent by ``payouts``): rows are grouped by the
+provider recorded on the transaction (the primary provider for the owner's
+region for rows from before it was recorded), at most ``concurrency`` requests
+are in flight in total, and each provider is held to its
+``RECONCILE_RATE_LIMITS`` rate by a token bucket. Final statuses are
+applied with one ``settle_transactions`` call per chunk.
+
+As with streamed payments and provider webhooks, a completion is only
+applied when the provider reports the amount the transaction was sent out
+for (SEP-24 ``amount_in``; see ``payment_stream.expected_amounts``);
+otherwise it is logged and the row stays pending. Payouts found on Horizon
+by their hash need no check: the hash pins the envelope we built.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import zip_longest
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from stellar_sdk import Server
+
+from . import payouts, providers
+from .models import Transaction
+from .payment_factory import MonitoredService, PaymentFactory
+from .payment_stream import expected_amounts
+from .transact import settle_transactions
+from .transport import horizon_client
+
+logger = logging.getLogger(__name__)
+
+# SEP-24 transaction statuses that are final, mapped to ours.
+SEP24_STATUSES = {
+    'completed': 'completed',
+    'refunded': 'failed',
+    'expired': 'failed',
+    'error': 'failed',
+    'no_market': 'failed',
+    'too_small': 'failed',
+    'too_large': 'failed',
+}
+# Requests per second per provider, when RECONCILE_RATE_LIMITS has no entry.
+DEFAULT_RATE = 50.0
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average, with bursts up to ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def normalize_status(response):
+    """Our final status for a provider status response, or ``None`` if still in progress."""
+    if not isinstance(response, dict) or 'error' in response:
+        return None
+    transaction = response.get('transaction')
+    if isinstance(transaction, dict):
+        return SEP24_STATUSES.get(transaction.get('status'))
+    if 'status' in response:
+        return SEP24_STATUSES.get(response['status'])
+    # A bridge answers per leg; the Stellar anchor leg decides.
+    return normalize_status(response.get('stellar_status'))
+
+
+def reported_amount(response):
+    """The amount a provider status response says the transaction was for, or ``None``."""
+    if not isinstance(response, dict):
+        return None
+    transaction = response.get('transaction')
+    if isinstance(transaction, dict):
+        return _amount(transaction.get('amount_in'))
+    if 'status' in response:
+        return _amount(response.get('amount_in'))
+    return reported_amount(response.get('stellar_status'))
+
+
+def _amount(value):
+    try:
+        return Decimal(str(value)) if value is not None else None
+    except InvalidOperation:
+        return None
+
+
+def pending_chunks(chunk_size, min_age):
+    """
+    Yield lists of ``(pk, external_transaction_id, provider, region, payout_hash, amount)``
+    for pending rows, oldest first.
+    """
+    cutoff = timezone.now() - min_age
+    queryset = (Transaction.objects
+                .filter(status='pending', created_at__lt=cutoff)
+                .order_by('created_at', 'id')
+                .values_list('created_at', 'pk', 'external_transaction_id', 'provider', 'user__userprofile__region',
+                             'payout_hash', 'amount'))
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            page = page.filter(Q(created_at__gt=last[0]) | Q(created_at=last[0], pk__gt=last[1]))
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+        last = rows[-1][:2]
+        yield [row[1:] for row in rows]
+
+
+class Reconciler:
+    def __init__(self, concurrency=16):
+        self.concurrency = concurrency
+        self._buckets = {}
+        self._horizon = None
+        self._lock = threading.Lock()
+
+    def run(self, chunk_size=1000, min_age=timedelta(minutes=5), limit=None):
+        """Reconcile pending rows; returns ``{'checked', 'completed', 'failed'}`` counts."""
+        totals = {'checked': 0, 'completed': 0, 'failed': 0}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='reconcile') as executor:
+            for chunk in pending_chunks(chunk_size, min_age):
+                if limit is not None:
+                    chunk = chunk[:limit - totals['checked']]
+                outcomes = self.check_chunk(chunk, executor)
+                settled = settle_transactions(outcomes)
+                totals['checked'] += len(chunk)
+                for transaction in settled:
+                    totals[transaction.status] += 1
+                if limit is not None and totals['checked'] >= limit:
+                    break
+        return totals
+
+    def check_chunk(self, chunk, executor):
+        """``{pk: final status}`` for the rows in ``chunk`` that have one."""
+        by_provider = {}
+        amounts = {}
+        for pk, external_id, provider, region, payout_hash, amount in chunk:
+            if payout_hash:
+                # Paid out on Stellar; the ledger has the final word.
+                by_provider.setdefault(payouts.PROVIDER, []).append((pk, payouts.PROVIDER, payout_hash))
+                continue
+            if not external_id:
+                # Never reached the anchor; the outbox dispatcher owns these.
+                continue
+            name = provider or PaymentFactory.routes_for(region)[0]
+            by_provider.setdefault(name, []).append((pk, name, external_id))
+            amounts[pk] = amount
+        # Interleave providers so workers waiting on one provider's rate
+        # limit don't hold up the others.
+        jobs = [job for jobs in zip_longest(*by_provider.values()) for job in jobs if job is not None]
+        results = [(pk, status, reported) for pk, (status, reported)
+                   in executor.map(lambda job: (job[0], self._check(job[1], job[2])), jobs) if status is not None]
+
+        completed = [(pk, None, amounts[pk]) for pk, status, _ in results if status == 'completed' and pk in amounts]
+        expected = expected_amounts(completed) if completed else {}
+        outcomes = {}
+        for pk, status, reported in results:
+            if pk in expected and reported != expected[pk]:
+                logger.error(f"Provider reports transaction {pk} completed for {reported}, "
+                             f"expected {expected[pk]}; leaving it pending")
+                continue
+            outcomes[pk] = status
+        return outcomes
+
+    def _check(self, name, external_id):
+        """``(final status or None, reported amount or None)`` for one row."""
+        self._bucket(name).acquire()
+        try:
+            if name == payouts.PROVIDER:
+                return payouts.check_status(self._horizon_server(), external_id), None
+            response = MonitoredService(name, providers.get(name)).check_transaction_status(external_id)
+        except Exception as e:
+            logger.warning(f"Status check for {external_id} at {name} failed: {e}")
+            return None, None
+        return normalize_status(response), reported_amount(response)
+
+    def _horizon_server(self):
+        if self._horizon is None:
+            with self._lock:
+                if self._horizon is None:
+                    self._horizon = Server(settings.STELLAR_HORIZON_URL, client=horizon_client())
+        return self._horizon
+
+    def _bucket(self, name):
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(name)
+                if bucket is None:
+                    rates = getattr(settings, 'RECONCILE_RATE_LIMITS', {})
+                    rate = rates.get(name, rates.get('default', DEFAULT_RATE))
+                    bucket = self._buckets[name] = TokenBucket(rate)
+        return bucket
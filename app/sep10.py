@@ -0,0 +1,213 @@
+"""
+SEP-10 web authentication against the anchor, with a shared token cache.
+
+Getting a token costs a challenge fetch, a signature and a second round
+trip, so tokens are cached per ``(auth endpoint, account, memo)`` until
+shortly before the ``exp`` in their JWT. Refreshes are single-flight: one
+thread fetches while concurrent callers for the same key wait for it, or
+keep using the current token if it has not expired yet. The cache holds at
+most ``SEP10_TOKEN_CACHE_SIZE`` tokens (one per user memo on the shared
+platform account) and drops the least recently refreshed one beyond that.
+
+Before signing, the challenge is validated with the SDK: it must be signed
+by the anchor's ``SIGNING_KEY`` (``ANCHOR_SIGNING_KEY``, or the one
+published in the anchor's stellar.toml), name our home and web auth
+domains, be within its time bounds and be for our account and memo.
+"""
+import base64
+import json
+import threading
+import time
+import tomllib
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from stellar_sdk.sep.exceptions import InvalidSep10ChallengeError
+from stellar_sdk.sep.stellar_web_authentication import read_challenge_transaction
+
+from .transport import session_for
+
+# Refresh this many seconds before the token expires.
+DEFAULT_REFRESH_MARGIN = 60
+# Lifetime assumed for tokens that carry no readable ``exp`` claim.
+DEFAULT_TTL = 300
+DEFAULT_CACHE_SIZE = 10000
+
+
+class ChallengeError(Exception):
+    pass
+
+
+class TokenCache:
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._tokens = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        """Return a cached token for ``key``, calling ``fetch()`` to refresh it when due."""
+        now = time.time()
+        cached = self._tokens.get(key)
+        if cached is not None and now < cached[1] - _refresh_margin():
+            return cached[0]
+
+        lock = self._lock_for(key)
+        if cached is not None and now < cached[1]:
+            # Due for refresh but still valid: refresh if nobody else is,
+            # otherwise keep serving the current token.
+            if not lock.acquire(blocking=False):
+                return cached[0]
+        else:
+            lock.acquire()
+        try:
+            cached = self._tokens.get(key)
+            if cached is not None and time.time() < cached[1] - _refresh_margin():
+                return cached[0]
+            try:
+                token = fetch()
+            except Exception:
+                if cached is None:
+                    # Nothing cached for this key; do not keep its lock around either.
+                    with self._lock:
+                        self._locks.pop(key, None)
+                raise
+            self._store(key, token)
+            return token
+        finally:
+            lock.release()
+
+    def peek(self, key):
+        """The cached token for ``key`` if it needs no refresh, else ``None``."""
+        cached = self._tokens.get(key)
+        if cached is not None and time.time() < cached[1] - _refresh_margin():
+            return cached[0]
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._locks.clear()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _store(self, key, token):
+        maxsize = self.maxsize or getattr(settings, 'SEP10_TOKEN_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        with self._lock:
+            self._tokens[key] = (token, expiry(token))
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > maxsize:
+                evicted, _ = self._tokens.popitem(last=False)
+                self._locks.pop(evicted, None)
+
+    def _lock_for(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            with self._lock:
+                lock = self._locks.setdefault(key, threading.Lock())
+        return lock
+
+
+token_cache = TokenCache()
+
+
+def auth_url(anchor_url):
+    return getattr(settings, 'ANCHOR_AUTH_URL', None) or f"{anchor_url.rstrip('/')}/auth"
+
+
+def cache_key(url, keypair, memo=None):
+    return url, keypair.public_key, None if memo is None else str(memo)
+
+
+def get_token(url, keypair, network_passphrase, memo=None, anchor_url=None):
+    """A valid SEP-10 JWT for ``keypair`` (and ``memo``, for shared accounts)."""
+    return token_cache.get(cache_key(url, keypair, memo),
+                           lambda: authenticate(url, keypair, network_passphrase, memo, anchor_url=anchor_url))
+
+
+def authenticate(url, keypair, network_passphrase, memo=None, signing_key=None, home_domain=None, anchor_url=None):
+    """
+    Run the SEP-10 challenge/response exchange and return the JWT.
+
+    ``signing_key`` and ``home_domain`` default to those of ``anchor_url``
+    (``ANCHOR_URL`` if not given); see ``anchor_signing_key()``.
+    """
+    http = session_for('stellar_anchor')
+    params = {'account': keypair.public_key}
+    if memo is not None:
+        params['memo'] = str(memo)
+    response = http.get(url, params=params)
+    response.raise_for_status()
+    challenge = response.json()
+
+    try:
+        # Checks the anchor's signature, the domains and the time bounds, and
+        # that sequence number is 0 so the transaction can never be submitted.
+        verified = read_challenge_transaction(
+            challenge['transaction'], signing_key or anchor_signing_key(anchor_url),
+            home_domain or anchor_home_domain(anchor_url),
+            urlsplit(url).hostname, network_passphrase)
+    except (InvalidSep10ChallengeError, ValueError) as e:
+        raise ChallengeError(f"Invalid challenge transaction: {e}")
+    if verified.client_account_id != keypair.public_key:
+        raise ChallengeError('Challenge transaction is for another account')
+    if verified.memo != (None if memo is None else int(memo)):
+        raise ChallengeError('Challenge transaction has the wrong memo')
+    envelope = verified.transaction
+    envelope.sign(keypair)
+
+    response = http.post(url, json={'transaction': envelope.to_xdr()})
+    response.raise_for_status()
+    return response.json()['token']
+
+
+def anchor_home_domain(anchor_url=None):
+    return getattr(settings, 'ANCHOR_HOME_DOMAIN', None) or urlsplit(anchor_url or settings.ANCHOR_URL).hostname
+
+
+_signing_keys = {}
+
+
+def anchor_signing_key(anchor_url=None):
+    """``ANCHOR_SIGNING_KEY``, or the ``SIGNING_KEY`` published in the anchor's stellar.toml."""
+    configured = getattr(settings, 'ANCHOR_SIGNING_KEY', None)
+    if configured:
+        return configured
+    toml_url = urljoin(anchor_url or settings.ANCHOR_URL, '/.well-known/stellar.toml')
+    signing_key = _signing_keys.get(toml_url)
+    if signing_key is None:
+        response = session_for('stellar_anchor').get(toml_url)
+        response.raise_for_status()
+        try:
+            signing_key = tomllib.loads(response.text)['SIGNING_KEY']
+        except (tomllib.TOMLDecodeError, KeyError):
+            raise ChallengeError(f"No SIGNING_KEY in {toml_url}")
+        _signing_keys[toml_url] = signing_key
+    return signing_key
+
+
+def expiry(token):
+    """The ``exp`` claim of a JWT as a UNIX timestamp, without verifying it."""
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + DEFAULT_TTL
+
+
+def _refresh_margin():
+    return getattr(settings, 'SEP10_REFRESH_MARGIN', DEFAULT_REFRESH_MARGIN)
+
+
+def _clear_on_setting_change(setting, **kwargs):
+    if setting in ('ANCHOR_URL', 'ANCHOR_AUTH_URL', 'ANCHOR_HOME_DOMAIN', 'ANCHOR_SIGNING_KEY',
+                   'STELLAR_PLATFORM_SECRET'):
+        token_cache.clear()
+        _signing_keys.clear()
+
+
+setting_changed.connect(_clear_on_setting_change)
@@ -1,23 +1,28 @@
-import requests
 from urllib.parse import urljoin
-from stellar_sdk import TransactionBuilder, Network, Keypair, Server
+from stellar_sdk import Asset, TransactionBuilder, Network, Keypair, Server
+from stellar_sdk.exceptions import BadRequestError
 from django.conf import settings
-from rest_framework.authtoken.models import Token
+from app import channels, sep10
 from app.models import Transaction
+from app.transport import session_for, horizon_client
+
+# Seconds a payout waits for a free channel account before giving up.
+PAYOUT_CHANNEL_TIMEOUT = 30
 
 
 class StellarAnchorService:
     def __init__(self, anchor_url):
         self.network = Network.PUBLIC_NETWORK_PASSPHRASE
-        self.server = Server("https://horizon-testnet.stellar.org")
+        self.server = Server(settings.STELLAR_HORIZON_URL, client=horizon_client())
         self.platform_keypair = Keypair.from_secret(settings.STELLAR_PLATFORM_SECRET)
         self.anchor_url = anchor_url  # Initialize anchor URL
         self.asset_code = "USDC"
         self.asset_issuer = settings.USDC_ISSUER_PUBLIC_KEY
+        self.http = session_for('stellar_anchor')
 
     def initiate_deposit(self, user, amount):
         headers = {
-            "Authorization": f"Bearer {Token}",
+            "Authorization": f"Bearer {self.get_auth_token(user)}",
             "Content-Type": "application/json"
         }
         data = {
@@ -25,7 +30,7 @@ class StellarAnchorService:
             "account": self.platform_keypair.public_key,
             "amount": str(amount)
         }
-        response = requests.post(urljoin(self.anchor_url, "/transactions/deposit/interactive"), headers=headers,
+        response = self.http.post(urljoin(self.anchor_url, "/transactions/deposit/interactive"), headers=headers,
                                  json=data)
 
         if response.status_code == 200:
@@ -35,7 +40,7 @@ class StellarAnchorService:
 
     def initiate_withdrawal(self, user, amount):
         headers = {
-            "Authorization": f"Bearer {Token}",
+            "Authorization": f"Bearer {self.get_auth_token(user)}",
             "Content-Type": "application/json"
         }
         data = {
@@ -43,7 +48,7 @@ class StellarAnchorService:
             "account": self.platform_keypair.public_key,
             "amount": str(amount)
         }
-        response = requests.post(urljoin(self.anchor_url, "/transactions/withdraw/interactive"), headers=headers,
+        response = self.http.post(urljoin(self.anchor_url, "/transactions/withdraw/interactive"), headers=headers,
                                  json=data)
 
         if response.status_code == 200:
@@ -52,12 +57,16 @@ class StellarAnchorService:
             return {"error": "Failed to initiate withdrawal", "details": response.text}
 
     def check_transaction_status(self, transaction_id):
-        response = requests.get(urljoin(self.anchor_url, f"/transactions/{transaction_id}"))
+        response = self.http.get(urljoin(self.anchor_url, f"/transactions/{transaction_id}"))
         if response.status_code == 200:
             return response.json()
         else:
             return {"error": "Failed to check transaction status", "details": response.text}
 
+    def get_auth_token(self, user):
+        return sep10.get_token(sep10.auth_url(self.anchor_url), self.platform_keypair, self.network, user.pk,
+                               anchor_url=self.anchor_url)
+
     @staticmethod
     def process_anchor_callback(callback_data):
         transaction_id = callback_data.get('transaction_id')
@@ -79,24 +88,50 @@ class StellarAnchorService:
 
     def send_payment(self, destination, amount):
         try:
-            transaction = (
-                TransactionBuilder(
-                    source_account=self.server.load_account(self.platform_keypair.public_key),
-                    network_passphrase=self.network,
-                    base_fee=100
-                )
-                .append_payment_op(
-                    destination=destination,
-                    asset_code=self.asset_code,
-                    asset_issuer=self.asset_issuer,
-                    amount=str(amount)
-                )
-                .set_timeout(30)
-                .build()
-            )
+            return self.submit_payments([(destination, amount)])
+        except Exception as e:
+            return {'error': str(e)}
 
+    def submit_payments(self, payments, before_submit=None):
+        """
+        Submit one transaction paying each ``(destination, amount)`` in
+        ``payments`` from the platform account; raises on failure.
+        ``before_submit(hash)`` is called with the hash of each signed
+        envelope before it goes to Horizon.
+        """
+        with channels.channel_pool(self.platform_keypair).acquire(timeout=PAYOUT_CHANNEL_TIMEOUT) as channel:
+            try:
+                return self._submit_payments(channel, payments, before_submit)
+            except BadRequestError as e:
+                if channels.result_code(e) != 'tx_bad_seq':
+                    raise
+                # Another writer moved the channel's sequence on; the
+                # cache was reset by _submit_payments, so retry once.
+                return self._submit_payments(channel, payments, before_submit)
+
+    def _submit_payments(self, channel, payments, before_submit=None):
+        source = channels.sequence_numbers.reserve(self.server, channel.public_key)
+        # The payments always come from the platform account; a channel only
+        # provides the transaction's source, sequence number and fee.
+        op_source = self.platform_keypair.public_key if channel.public_key != self.platform_keypair.public_key else None
+        builder = TransactionBuilder(
+            source_account=source,
+            network_passphrase=self.network,
+            base_fee=100
+        )
+        asset = Asset(self.asset_code, self.asset_issuer)
+        for destination, amount in payments:
+            builder.append_payment_op(destination=destination, asset=asset, amount=str(amount), source=op_source)
+        transaction = builder.set_timeout(30).build()
+
+        transaction.sign(channel)
+        if op_source is not None:
             transaction.sign(self.platform_keypair)
-            response = self.server.submit_transaction(transaction)
-            return response
+        if before_submit is not None:
+            before_submit(transaction.hash_hex())
+        try:
+            return self.server.submit_transaction(transaction)
         except Exception as e:
-            return {'error': str(e)}
+            if not channels.sequence_consumed(e):
+                channels.sequence_numbers.invalidate(channel.public_key)
+            raise
@@ -1,8 +1,10 @@
 import logging
-from django.conf import settings
-from django.db import transaction
-from .models import USDAccount, Transaction
-from .payment_services import StellarAnchorService
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from . import fees, ledger, providers
+from .models import User, USDAccount, Transaction, OutboxMessage
 
 logger = logging.getLogger(__name__)
 
@@ -15,111 +17,134 @@ class UserNotVerifiedError(Exception):
     pass
 
 
-class DepositService:
-    def __init__(self):
-        self.anchor_service = StellarAnchorService()
+FINAL_STATUSES = ('completed', 'failed')
+WITHDRAWAL_TYPES = ('withdraw', 'withdrawal')
 
-    def initiate_deposit(self, user, amount):
-        fee_percentage = settings.DEPOSIT_FEE_PERCENTAGE
-        fee = amount * (fee_percentage / 100)
-        net_amount = amount - fee
-        # Step 1: Initiate deposit with anchor
-        anchor_response = self.anchor_service.initiate_deposit(user, net_amount)
 
-        if 'error' in anchor_response:
-            return anchor_response
+def settle_transactions(outcomes):
+    """
+    Move pending deposits and withdrawals to their final status in bulk.
 
-        # Step 2: Create pending transaction record
-        transaction = Transaction.objects.create(
-            user=user,
-            amount=amount,
-            transaction_type='deposit',
-            status='pending',
-            external_transaction_id=anchor_response.get('id')
-        )
+    ``outcomes`` maps ``Transaction`` ids to ``'completed'`` or ``'failed'``
+    (other statuses are ignored). Only rows that are still pending change,
+    so replayed callbacks and overlapping sweeps are harmless: completed
+    deposits are credited and failed withdrawals refunded exactly once.
+    Returns the transactions that were settled.
+    """
+    outcomes = {pk: status for pk, status in outcomes.items() if status in FINAL_STATUSES}
+    if not outcomes:
+        return []
+
+    with db_transaction.atomic():
+        settled = list(Transaction.objects.select_for_update()
+                       .filter(pk__in=outcomes, status='pending').order_by('pk'))
+        credits = {}
+        entries = []
+        by_status = {}
+        for transaction in settled:
+            transaction.status = outcomes[transaction.pk]
+            by_status.setdefault(transaction.status, []).append(transaction.pk)
+            is_deposit = transaction.transaction_type == 'deposit'
+            is_withdrawal = transaction.transaction_type in WITHDRAWAL_TYPES
+            if (is_deposit and transaction.status == 'completed') or \
+                    (is_withdrawal and transaction.status == 'failed'):
+                # Deposit lands, or a failed withdrawal is refunded.
+                credits[transaction.user_id] = credits.get(transaction.user_id, Decimal('0')) + transaction.amount
+                entries.append((transaction, [
+                    ledger.debit(ledger.CLEARING, transaction.amount),
+                    ledger.credit(transaction.user_id, transaction.amount),
+                ]))
+
+        now = timezone.now()
+        for status, pks in by_status.items():
+            Transaction.objects.filter(pk__in=pks).update(status=status, updated_at=now)
+        if credits:
+            USDAccount.objects.credit_many(credits)
+            ledger.post_many(entries)
+    return settled
+
+
+class DepositService:
+    def initiate_deposit(self, user, amount):
+        amount = _parse_amount(amount)
+        if amount is None:
+            return {'error': 'Invalid amount'}
+        net_amount = fees.quote(fees.DEPOSIT, amount, fees.region_of(user)).net_amount
+        # Create the pending transaction and queue the anchor call together;
+        # the outbox dispatcher initiates the deposit with the anchor.
+        with db_transaction.atomic():
+            transaction = Transaction.objects.create(
+                user=user,
+                amount=amount,
+                transaction_type='deposit',
+                status='pending',
+                # The outbox dispatcher initiates it with the Stellar anchor.
+                provider=providers.STELLAR
+            )
+            OutboxMessage.objects.create(
+                transaction=transaction,
+                operation='deposit',
+                payload={'net_amount': str(net_amount)}
+            )
 
         return {
             'status': 'initiated',
-            'transaction_id': transaction.id,
-            'more_info_url': anchor_response.get('url')  # URL where user completes the deposit
+            'transaction_id': transaction.id
         }
 
     @staticmethod
     def process_deposit_callback(callback_data):
         # This method would be called when the anchor sends a callback
         transaction = Transaction.objects.get(external_transaction_id=callback_data['transaction_id'])
-
-        if callback_data['status'] == 'completed':
-            # Update user's USD account
-            usd_account = USDAccount.objects.get(user=transaction.user)
-            usd_account.deposit(transaction.amount)
-
-            # Update transaction status
-            transaction.status = 'completed'
-            transaction.save()
-
-        elif callback_data['status'] == 'failed':
-            transaction.status = 'failed'
-            transaction.save()
-
+        settle_transactions({transaction.pk: callback_data['status']})
         return {'status': 'processed'}
 
 
 class WithdrawalService:
-    def __init__(self):
-        self.anchor_service = StellarAnchorService()
-
     def initiate_withdrawal(self, user, amount):
         if not user.is_verified():
             return {'error': 'User not KYC verified'}
-        fee_percentage = settings.DEPOSIT_FEE_PERCENTAGE
-        fee = amount * (fee_percentage / 100)
-        net_amount = amount - fee
-        # Step 1: Check user's balance
+        amount = _parse_amount(amount)
+        if amount is None:
+            return {'error': 'Invalid amount'}
+        net_amount = fees.quote(fees.WITHDRAWAL, amount, fees.region_of(user)).net_amount
+        # Debit the balance, create the pending transaction and queue the
+        # anchor call atomically; if the anchor call ultimately fails the
+        # dispatcher fails the transaction, which refunds the debit.
         try:
-            usd_account = USDAccount.objects.get(user=user)
-            if usd_account.balance < amount:
-                return {'error': 'Insufficient funds'}
+            with db_transaction.atomic():
+                USDAccount.objects.debit(user, amount)
+                transaction = Transaction.objects.create(
+                    user=user,
+                    amount=amount,
+                    transaction_type='withdrawal',
+                    status='pending',
+                    provider=providers.STELLAR
+                )
+                ledger.post(transaction, [
+                    ledger.debit(user, amount),
+                    ledger.credit(ledger.CLEARING, amount),
+                ])
+                OutboxMessage.objects.create(
+                    transaction=transaction,
+                    operation='withdrawal',
+                    payload={'net_amount': str(net_amount)}
+                )
         except USDAccount.DoesNotExist:
             return {'error': 'User USD account not found'}
-
-        # Step 2: Initiate withdrawal with anchor
-        anchor_response = self.anchor_service.initiate_withdrawal(user, net_amount)
-
-        if 'error' in anchor_response:
-            return anchor_response
-
-        # Step 3: Create pending transaction record and deduct balance
-        transaction = Transaction.objects.create(
-            user=user,
-            amount=amount,
-            transaction_type='withdrawal',
-            status='pending',
-            external_transaction_id=anchor_response.get('id')
-        )
-        usd_account.withdraw(amount)
+        except ValueError:
+            return {'error': 'Insufficient funds'}
 
         return {
             'status': 'initiated',
-            'transaction_id': transaction.id,
-            'more_info_url': anchor_response.get('url')  # URL where user completes the withdrawal
+            'transaction_id': transaction.id
         }
 
     @staticmethod
     def process_withdrawal_callback(callback_data):
         # This method would be called when the anchor sends a callback
         transaction = Transaction.objects.get(external_transaction_id=callback_data['transaction_id'])
-
-        if callback_data['status'] == 'completed':
-            # Update transaction status
-            transaction.status = 'completed'
-            transaction.save()
-        elif callback_data['status'] == 'failed':
-            # Refund the user's account and update transaction status
-            usd_account = USDAccount.objects.get(user=transaction.user)
-            usd_account.deposit(transaction.amount)  # Refund
-            transaction.status = 'failed'
-            transaction.save()
+        settle_transactions({transaction.pk: callback_data['status']})
 
         if callback_data['status'] == 'failed':
             logger.error(f"Withdrawal failed for transaction {callback_data['transaction_id']}")
@@ -130,18 +155,129 @@ class TransferService:
     def process_internal_transfer(self, sender, recipient, amount):
         if not sender.is_verified():
             return {'error': 'User not KYC verified'}
-        fee_percentage = settings.DEPOSIT_FEE_PERCENTAGE
-        fee = amount * (fee_percentage / 100)
-        net_amount = amount - fee
-        with transaction.atomic():
-            if sender.usd_account.balance < amount:
+        amount = _parse_amount(amount)
+        if amount is None:
+            return {'error': 'Invalid amount'}
+        quote = fees.quote(fees.TRANSFER, amount, fees.region_of(sender))
+        fee, net_amount = quote.fee, quote.net_amount
+        with db_transaction.atomic():
+            # The guarded debit doubles as the funds check, so there is no
+            # window between checking the balance and spending it.
+            try:
+                USDAccount.objects.debit(sender, amount)
+            except ValueError:
                 raise InsufficientFundsError("Insufficient funds")
-
-            # Proceed with the transfer
-            sender.usd_account.withdraw(amount)
-            recipient.usd_account.deposit(net_amount)
+            USDAccount.objects.credit(recipient, net_amount)
 
             # Create transaction records
-            self._create_transaction(sender, 'transfer', amount, f"Transfer to {recipient.username}")
+            outgoing = self._create_transaction(sender, 'transfer', amount, f"Transfer to {recipient.username}")
             self._create_transaction(recipient, 'transfer', amount, f"Transfer from {sender.username}")
+            ledger.post(outgoing, [
+                ledger.debit(sender, amount),
+                ledger.credit(recipient, net_amount),
+                ledger.credit(ledger.CLEARING, fee),
+            ])
+
+        return {'status': 'completed'}
+
+    def process_bulk_transfer(self, sender, transfers):
+        """
+        Apply many transfers from ``sender`` in one database transaction.
+
+        ``transfers`` is a list of ``{'recipient': username, 'amount': ...}``
+        items. All involved accounts are locked up front in primary-key
+        order, so concurrent batches cannot deadlock each other; balances
+        are then changed with one guarded debit and set-based credits, and
+        the ``Transaction`` rows and ledger postings are bulk-inserted.
+        Returns one result per item, in order; items that fail validation
+        or would overdraw the sender are skipped, not the whole batch.
+        """
+        if not sender.is_verified():
+            return {'error': 'User not KYC verified'}
+
+        results = [{'recipient': item.get('recipient'), 'amount': item.get('amount')} for item in transfers]
+        usernames = {result['recipient'] for result in results if result['recipient']}
+        recipients = {user.username: user for user in User.objects.filter(username__in=usernames)}
+
+        with db_transaction.atomic():
+            locked = set(
+                USDAccount.objects.select_for_update()
+                .filter(user_id__in={sender.pk} | {user.pk for user in recipients.values()})
+                .order_by('pk')
+                .values_list('user_id', flat=True)
+            )
+            if sender.pk not in locked:
+                return {'error': 'User USD account not found'}
+            available = USDAccount.objects.balance_of(sender)
+
+            accepted = []
+            for result in results:
+                recipient = recipients.get(result['recipient'])
+                amount = _parse_amount(result['amount'])
+                if recipient is None or recipient.pk not in locked:
+                    result.update(status='failed', error='Recipient not found.')
+                elif amount is None:
+                    result.update(status='failed', error='Invalid amount.')
+                elif amount > available:
+                    result.update(status='failed', error='Insufficient funds')
+                else:
+                    available -= amount
+                    accepted.append((result, recipient, amount))
+
+            if accepted:
+                self._apply_bulk_transfer(sender, accepted)
+
+        return {'status': 'processed', 'results': results}
+
+    def _apply_bulk_transfer(self, sender, accepted):
+        credits = {}
+        transactions = []
+        entries = []
+        quotes = fees.quote_many(fees.TRANSFER, [amount for _, _, amount in accepted], fees.region_of(sender))
+        for (result, recipient, amount), quote in zip(accepted, quotes):
+            fee, net_amount = quote.fee, quote.net_amount
+            credits[recipient.pk] = credits.get(recipient.pk, Decimal('0')) + net_amount
+            outgoing = Transaction(user=sender, transaction_type='transfer', amount=amount, status='completed',
+                                   description=f"Transfer to {recipient.username}")
+            incoming = Transaction(user=recipient, transaction_type='transfer', amount=amount, status='completed',
+                                   description=f"Transfer from {sender.username}")
+            transactions.extend([outgoing, incoming])
+            entries.append((outgoing, [
+                ledger.debit(sender, amount),
+                ledger.credit(recipient, net_amount),
+                ledger.credit(ledger.CLEARING, fee),
+            ]))
+            result.update(status='completed', transaction_id=outgoing.id)
+
+        USDAccount.objects.debit(sender, sum((amount for _, _, amount in accepted), Decimal('0')))
+        USDAccount.objects.credit_many({user_id: amount for user_id, amount in credits.items() if amount > 0})
+        Transaction.objects.bulk_create(transactions)
+        ledger.post_many(entries)
+
+    @staticmethod
+    def _create_transaction(user, transaction_type, amount, description):
+        return Transaction.objects.create(
+            user=user,
+            transaction_type=transaction_type,
+            amount=amount,
+            status='completed',
+            description=description
+        )
+
+
+# Amounts are stored in numeric(12, 2) columns; anything finer than a cent
+# or larger than the column holds is refused instead of left to the
+# database to round or overflow.
+MAX_AMOUNT = Decimal('9999999999.99')
+
 
+def _parse_amount(value):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        return None
+    if not amount.is_finite() or amount <= 0 or amount > MAX_AMOUNT:
+        return None
+    if amount != amount.quantize(fees.CENT):
+        return None
+    return amount.quantize(fees.CENT)
@@ -0,0 +1,189 @@
+"""
+Shared HTTP transport for payment provider clients.
+
+Each provider gets one process-wide ``requests`` session with its own
+keep-alive connection pool, default connect/read timeouts and bounded
+retries. Retries back off with jitter and only repeat idempotent methods;
+connection failures, where the request never reached the server, are
+retried for any method.
+
+``async_client_for()`` offers the same per-provider pooling and timeouts
+for ASGI code paths through ``httpx``, which is optional: when it is not
+installed the async callers fall back to running the blocking client in a
+thread.
+
+Every call through either client is timed into ``metrics`` under its
+provider name.
+
+Per-provider settings come from ``HTTP_TRANSPORT`` in settings, layered
+over its ``'default'`` entry and then ``DEFAULTS`` below.
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULTS = {
+    'connect_timeout': 3.05,
+    'read_timeout': 10.0,
+    'pool_connections': 4,
+    'pool_maxsize': 10,
+    'retries': 2,
+    'backoff_factor': 0.25,
+    'backoff_jitter': 0.25,
+    'status_forcelist': (429, 502, 503, 504),
+    'async_max_connections': 1000,
+}
+
+_sessions = {}
+# Event loop -> {provider: client}. Held weakly, so a loop's clients are
+# dropped with it and a new loop can never be handed a dead loop's client.
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+class ProviderSession(requests.Session):
+    """``requests.Session`` that applies the provider's default timeout."""
+
+    def __init__(self, provider, config):
+        super().__init__()
+        self.provider = provider
+        self.timeout = (config['connect_timeout'], config['read_timeout'])
+        retry = Retry(
+            total=config['retries'],
+            backoff_factor=config['backoff_factor'],
+            backoff_jitter=config['backoff_jitter'],
+            status_forcelist=config['status_forcelist'],
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=config['pool_connections'],
+            pool_maxsize=config['pool_maxsize'],
+            max_retries=retry,
+        )
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        began = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = super().request(method, url, **kwargs)
+            outcome = metrics.status_class(response.status_code)
+            return response
+        finally:
+            metrics.observe_provider(self.provider, time.perf_counter() - began, outcome)
+
+
+if httpx is not None:
+    class ProviderAsyncClient(httpx.AsyncClient):
+        """``httpx.AsyncClient`` that times its calls like ``ProviderSession``."""
+
+        def __init__(self, provider, **kwargs):
+            super().__init__(**kwargs)
+            self.provider = provider
+
+        async def send(self, request, **kwargs):
+            began = time.perf_counter()
+            outcome = 'error'
+            try:
+                response = await super().send(request, **kwargs)
+                outcome = metrics.status_class(response.status_code)
+                return response
+            finally:
+                metrics.observe_provider(self.provider, time.perf_counter() - began, outcome)
+
+
+def provider_config(provider):
+    configured = getattr(settings, 'HTTP_TRANSPORT', {})
+    return {**DEFAULTS, **configured.get('default', {}), **configured.get(provider, {})}
+
+
+def session_for(provider):
+    """Return the shared session for ``provider``, creating it on first use."""
+    session = _sessions.get(provider)
+    if session is None:
+        with _lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = _sessions[provider] = ProviderSession(provider, provider_config(provider))
+    return session
+
+
+def async_client_for(provider):
+    """
+    Return the shared ``httpx.AsyncClient`` for ``provider`` on the running
+    event loop, or ``None`` if httpx is not installed.
+
+    Clients are bound to the loop that created them, so there is one per
+    provider per loop. They are dropped, and their connections released,
+    once that loop is garbage collected.
+    """
+    if httpx is None:
+        return None
+
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        with _lock:
+            clients = _async_clients.setdefault(loop, {})
+    client = clients.get(provider)
+    if client is None:
+        config = provider_config(provider)
+        client = clients[provider] = ProviderAsyncClient(
+            provider,
+            timeout=httpx.Timeout(config['read_timeout'], connect=config['connect_timeout']),
+            limits=httpx.Limits(max_connections=config['async_max_connections'],
+                                max_keepalive_connections=config['pool_maxsize']),
+            # httpx only retries failed connection attempts, which is safe for any method.
+            transport=httpx.AsyncHTTPTransport(retries=config['retries']),
+        )
+    return client
+
+
+def horizon_client():
+    """A stellar_sdk client that sends Horizon requests through the shared pool."""
+    from stellar_sdk.client.requests_client import RequestsClient
+
+    config = provider_config('horizon')
+    return RequestsClient(
+        pool_size=config['pool_maxsize'],
+        num_retries=config['retries'],
+        request_timeout=config['read_timeout'],
+        post_timeout=config['read_timeout'],
+        backoff_factor=config['backoff_factor'],
+        session=session_for('horizon'),
+    )
+
+
+def close_all():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        # Async clients may belong to loops that are gone; drop them and let
+        # the garbage collector release their connections.
+        _async_clients.clear()
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting == 'HTTP_TRANSPORT':
+        close_all()
+
+
+setting_changed.connect(_reset_on_setting_change)
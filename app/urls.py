@@ -1,7 +1,7 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 from .views import password_reset_request, password_reset_confirm, account_view, balance_view, \
-    transaction_view
+    transaction_view, transaction_export
 from knox import views as knox_views
 from .views import LoginView
 
@@ -13,12 +13,22 @@ urlpatterns = [
     path('deposit/', views.initiate_deposit, name='deposit'),
     path('withdraw/', views.initiate_withdrawal, name='withdraw'),
     path('transfer/', views.initiate_transfer, name='transfer'),
+    path('transfer/bulk/', views.initiate_bulk_transfer, name='bulk_transfer'),
+    path('callback/deposit/', views.anchor_callback, name='anchor_callback'),
+    path('callback/withdrawal/', views.withdrawal_callback, name='withdrawal_callback'),
     path('transaction/status/<str:transaction_id>/', views.transaction_status, name='transaction_status'),
     path('webhook/<str:provider>/', views.payment_webhook, name='payment_webhook'),
 
+    path('async/deposit/', async_views.initiate_deposit, name='async_deposit'),
+    path('async/withdraw/', async_views.initiate_withdrawal, name='async_withdraw'),
+    path('async/transaction/status/<str:transaction_id>/', async_views.transaction_status,
+         name='async_transaction_status'),
+
     path('account/', account_view, name='account_view'),
     path('balance/', balance_view, name='balance_view'),
     path('transactions/', transaction_view, name='transaction_view'),
+    path('transactions/export/', transaction_export, name='transaction_export'),
+    path('transactions/<uuid:transaction_id>/', views.transaction_detail, name='transaction_detail'),
 
     path('api/login/', LoginView.as_view(), name='login'),
     path('api/logout/', knox_views.LogoutView.as_view(), name='logout'),
@@ -2,33 +2,43 @@ import logging
 from email.message import EmailMessage
 from django.utils.encoding import force_str
 
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.sites.shortcuts import get_current_site
 from rest_framework.authtoken.serializers import AuthTokenSerializer
 from knox.views import LoginView as KnoxLoginView
-from django.contrib.auth.models import User
+from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator, PasswordResetTokenGenerator
 from django.core.mail import send_mail
 from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
+from django.utils.crypto import constant_time_compare
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework import status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from rest_framework.throttling import AnonRateThrottle
 from django.core.exceptions import ValidationError
 from django.contrib.auth.password_validation import validate_password
 
-from . import serializers
+from . import exports, inbox, metrics, outbox, pagination, serializers, webhooks
+from .balance_cache import balance_cache
+from .idempotency import idempotent
 from .models import UserProfile, Transaction, USDAccount
 from .payment_factory import PaymentFactory
 from .serializers import UserSerializer, UserProfileSerializer, USDAccountSerializer, TransactionSerializer
-from .transact import DepositService, WithdrawalService, TransferService
+from .transact import DepositService, WithdrawalService, TransferService, InsufficientFundsError
 
 logger = logging.getLogger(__name__)
 
+User = get_user_model()
+
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -182,7 +192,7 @@ def update_kyc_status(request):
 def account_view(request):
     """Retrieve the user's account details."""
     user = request.user
-    usd_account = get_object_or_404(USDAccount, user=user)
+    usd_account = USDAccount(user_id=user.pk, balance=_cached_balance(user))
     return Response(USDAccountSerializer(usd_account).data, status=status.HTTP_200_OK)
 
 
@@ -191,22 +201,66 @@ def account_view(request):
 def balance_view(request):
     """Retrieve the user's USD balance."""
     user = request.user
-    usd_account = get_object_or_404(USDAccount, user=user)
-    return Response({'balance': usd_account.balance}, status=status.HTTP_200_OK)
+    return Response({'balance': _cached_balance(user)}, status=status.HTTP_200_OK)
+
+
+def _cached_balance(user):
+    try:
+        return balance_cache.get(user.pk)
+    except USDAccount.DoesNotExist:
+        raise Http404("No USDAccount matches the given query.")
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def transaction_view(request):
-    """Retrieve a list of transactions for the user."""
+    """Retrieve a page of transactions for the user, newest first."""
     user = request.user
-    transactions = Transaction.objects.filter(user=user).order_by('-created_at')
+    page_size = pagination.parse_page_size(request.query_params.get('page_size'))
+    try:
+        transactions, next_cursor = pagination.paginate(
+            Transaction.objects.filter(user=user), request.query_params.get('cursor'), page_size
+        )
+    except pagination.InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     serializer = TransactionSerializer(transactions, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response({'results': serializer.data, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def transaction_detail(request, transaction_id):
+    """One of the user's transactions, with the anchor's URL to complete it once the anchor call was sent."""
+    transaction = get_object_or_404(Transaction, pk=transaction_id, user=request.user)
+    data = TransactionSerializer(transaction).data
+    data['more_info_url'] = outbox.more_info_url(transaction)
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def transaction_export(request):
+    """Stream the user's transaction history as CSV or NDJSON."""
+    user = request.user
+    file_format = request.query_params.get('file_format', 'csv')
+    if file_format not in exports.ENCODERS:
+        return Response({'error': 'file_format must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start = exports.parse_bound(request.query_params.get('start'))
+        end = exports.parse_bound(request.query_params.get('end'), end=True)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = exports.export_rows(user, start, end)
+    response = StreamingHttpResponse(exports.ENCODERS[file_format](rows),
+                                     content_type=exports.CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="transactions.{file_format}"'
+    return response
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def initiate_deposit(request):
     user = request.user
     amount = request.data.get('amount')
@@ -228,17 +282,22 @@ def initiate_deposit(request):
     return Response(result, status=status.HTTP_200_OK)
 
 
+class CallbackRateThrottle(AnonRateThrottle):
+    # The anchor sends far more than an anonymous client would; give it its own budget.
+    scope = 'callback'
+
+
 @api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([CallbackRateThrottle])
 def anchor_callback(request):
-    # This endpoint would be called by the anchor
-    callback_data = request.data
-    deposit_service = DepositService()
-    result = deposit_service.process_deposit_callback(callback_data)
-    return Response(result, status=200)
+    # This endpoint would be called by the anchor; processing happens in the process_callbacks worker
+    return _enqueue_callback('deposit', request)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def initiate_withdrawal(request):
     user = request.user
     amount = request.data.get('amount')
@@ -256,12 +315,22 @@ def initiate_withdrawal(request):
 
 
 @api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([CallbackRateThrottle])
 def withdrawal_callback(request):
     # This endpoint would be called by the anchor for withdrawal callbacks
+    return _enqueue_callback('withdrawal', request)
+
+
+def _enqueue_callback(kind, request):
+    # Verify the raw body before it is parsed; unsigned callbacks never reach the inbox.
+    if not webhooks.verifier_for(webhooks.ANCHOR).verify(request.headers, request.body):
+        return Response({'error': 'Invalid signature.'}, status=status.HTTP_401_UNAUTHORIZED)
     callback_data = request.data
-    withdrawal_service = WithdrawalService()
-    result = withdrawal_service.process_withdrawal_callback(callback_data)
-    return Response(result, status=200)
+    if not isinstance(callback_data, dict) or not callback_data.get('transaction_id'):
+        return Response({'error': 'transaction_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+    inbox.enqueue(kind, callback_data)
+    return Response({'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
 
 
 class TransferError(Exception):
@@ -271,6 +340,7 @@ class TransferError(Exception):
 # Transfers
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def initiate_transfer(request):
     sender = request.user
     recipient_username = request.data.get("recipient")
@@ -283,7 +353,10 @@ def initiate_transfer(request):
             return Response({"error": "Recipient not found."}, status=status.HTTP_404_NOT_FOUND)
 
         transfer_service = TransferService()
-        result = transfer_service.process_internal_transfer(sender, recipient, amount)
+        try:
+            result = transfer_service.process_internal_transfer(sender, recipient, amount)
+        except InsufficientFundsError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         if "error" in result:
             return Response({"error": result["error"]}, status=status.HTTP_400_BAD_REQUEST)
@@ -291,11 +364,38 @@ def initiate_transfer(request):
     return Response({"message": "Transfer successful"}, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def initiate_bulk_transfer(request):
+    sender = request.user
+    transfers = request.data.get("transfers")
+
+    if not isinstance(transfers, list) or not transfers:
+        return Response({"error": "transfers must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(transfers) > settings.BULK_TRANSFER_MAX_ITEMS:
+        return Response({"error": f"At most {settings.BULK_TRANSFER_MAX_ITEMS} transfers per request."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if not all(isinstance(item, dict) for item in transfers):
+        return Response({"error": "Each transfer must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+
+    result = TransferService().process_bulk_transfer(sender, transfers)
+
+    if "error" in result:
+        return Response({"error": result["error"]}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(result, status=status.HTTP_200_OK)
+
+
 # Transaction Status
 @api_view(['GET'])
 def transaction_status(request, transaction_id):
     logger.info(f"Checking status for transaction {transaction_id}")
-    payment_service = PaymentFactory.get_payment_service(request.user.region)
+    provider = (Transaction.objects.filter(user=request.user, external_transaction_id=transaction_id)
+                .values_list('provider', flat=True).first())
+    payment_service = PaymentFactory.get_status_service(request.user.userprofile.region, provider)
+    if payment_service is None:
+        return Response({"error": "Status is not available for this transaction."},
+                        status=status.HTTP_404_NOT_FOUND)
 
     status_response = payment_service.check_transaction_status(transaction_id)
 
@@ -308,42 +408,18 @@ def transaction_status(request, transaction_id):
 
 
 # Payment Webhooks
-@api_view(['POST'])
+@csrf_exempt
+@require_POST
 def payment_webhook(request, provider):
-    # Handle webhook from different providers
-    if provider == "flutterwave":
-        # Process the Flutterwave webhook
-        pass
-    elif provider == "tempo":
-        # Process the Tempo webhook
-        pass
-    elif provider == "moneygram":
-        # Process the Tempo webhook
-        pass
-    elif provider == "circle":
-        # Process the Tempo webhook
-        pass
-    elif provider == "settle_network":
-        # Process the Tempo webhook
-        pass
-    elif provider == "alchemy_pay":
-        # Process the Tempo webhook
-        pass
-
-    return Response({"message": "Webhook processed successfully."}, status=status.HTTP_200_OK)
-
-
-@api_view(['POST'])
-def circle_webhook(request):
-    data = request.data
-    payment_id = data.get('id')
-    status = data.get('status')
-
-    # Update the transaction status in your database
-    try:
-        transaction = Transaction.objects.get(id=payment_id)
-        transaction.status = status  # Update to 'completed', 'pending', etc.
-        transaction.save()
-        return Response({"message": "Transaction status updated."}, status=status.HTTP_200_OK)
-    except Transaction.DoesNotExist:
-        return Response({"error": "Transaction not found."}, status=status.HTTP_404_NOT_FOUND)
+    """Verify, deduplicate and apply a provider webhook; see ``webhooks.handle``."""
+    status_code, body = webhooks.handle(provider, request.headers, request.body)
+    return JsonResponse(body, status=status_code)
+
+
+@require_GET
+def metrics_view(request):
+    """Request, database and provider metrics in the Prometheus text format."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
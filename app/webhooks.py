@@ -0,0 +1,274 @@
+"""
+Provider webhook pipeline: verify, deduplicate, settle.
+
+``handle()`` runs one delivery through these stages, cheapest first:
+
+1. Authenticate the raw body against the provider's shared secret, as an
+   HMAC in the provider's signature header (or, for providers that only
+   echo a static secret, by comparing that header). The keyed HMAC state
+   for each provider is built once and copied per request.
+2. Parse the provider's payload into an ``Event``: a stable event id, our
+   ``external_transaction_id``, the provider status normalized to
+   ``'completed'``/``'failed'`` (``None`` while still in progress) and the
+   amount and currency it reports.
+3. Drop redeliveries: an in-process LRU of recently seen ``(provider,
+   event_id)`` pairs answers without touching the database, and the
+   unique ``WebhookEvent`` row catches the rest (other processes,
+   evicted entries).
+4. Look the transaction up among the ones held by this provider
+   (``Transaction.provider``), and refuse a final status whose amount or
+   currency does not match what the provider was asked to move.
+5. Record the event and settle its transaction in one database
+   transaction, so an event is only marked seen once it has been applied.
+
+Per-provider secrets and overrides come from ``WEBHOOKS`` in settings,
+layered over the provider's entry in ``PROVIDERS`` and ``DEFAULTS``.
+Anchor callbacks are signed the same way under ``WEBHOOKS['anchor']``
+but are queued in the inbox rather than settled here, so the anchor is
+not one of the ``PROVIDERS`` routed to ``handle()``.
+
+Circle is not routed either: it signs notifications with ECDSA, and
+verifying those needs the ``cryptography`` package, which this project
+does not depend on.
+
+Nothing creates transactions held by these providers yet: deposits and
+withdrawals are initiated with the Stellar anchor through the outbox
+(``Transaction.provider`` is ``'stellar'``) and settled by its callbacks,
+so until a bridge initiates transactions of its own every provider event
+is answered with 404 and changes nothing.
+"""
+import base64
+import binascii
+import hmac
+import json
+import logging
+import threading
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction as db_transaction
+
+from .balance_cache import LRUCache
+from .models import Transaction, WebhookEvent
+from .payment_stream import expected_amounts
+from .reconcile import SEP24_STATUSES
+from .transact import settle_transactions
+
+logger = logging.getLogger(__name__)
+
+
+class Event(NamedTuple):
+    event_id: str
+    external_transaction_id: str
+    status: str | None
+    amount: Decimal | None = None
+    currency: str | None = None
+
+
+class WebhookError(Exception):
+    status_code = 400
+
+
+class UnknownProvider(WebhookError):
+    status_code = 404
+
+
+class InvalidSignature(WebhookError):
+    status_code = 401
+
+
+# Currencies a transaction's amount (USD, settled as USDC) may be reported in.
+CURRENCIES = ('USD', 'USDC')
+
+
+def _status(mapping, value):
+    return mapping.get(str(value).lower()) if value is not None else None
+
+
+def _amount(value):
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value!r}")
+
+
+def _currency(value):
+    return str(value).upper() if value is not None else None
+
+
+FLUTTERWAVE_STATUSES = {'successful': 'completed', 'failed': 'failed', 'cancelled': 'failed'}
+GENERIC_STATUSES = {**SEP24_STATUSES, 'success': 'completed', 'successful': 'completed', 'paid': 'completed',
+                    'failed': 'failed', 'cancelled': 'failed', 'canceled': 'failed'}
+
+
+def _parse_flutterwave(payload):
+    data = payload['data']
+    status = data.get('status')
+    # Flutterwave has no delivery id; the event, charge and status identify
+    # the state change, which is what a redelivery repeats.
+    return Event(f"{payload.get('event')}:{data['id']}:{status}", str(data['tx_ref']),
+                 _status(FLUTTERWAVE_STATUSES, status), _amount(data.get('amount')), _currency(data.get('currency')))
+
+
+def _parse_generic(payload):
+    status = payload.get('status')
+    event_id = payload.get('event_id') or f"{payload['transaction_id']}:{status}"
+    return Event(str(event_id), str(payload['transaction_id']), _status(GENERIC_STATUSES, status),
+                 _amount(payload.get('amount')), _currency(payload.get('currency')))
+
+
+DEFAULTS = {
+    'secret': '',
+    'scheme': 'hmac',
+    'header': 'X-Signature',
+    'digest': 'sha256',
+    'encoding': 'hex',
+}
+
+# ``provider`` is the ``Transaction.provider`` (app/providers.py name) of the
+# transactions a webhook may settle, when it differs from the webhook's name.
+PROVIDERS = {
+    'flutterwave': {'parse': _parse_flutterwave, 'header': 'flutterwave-signature', 'encoding': 'base64'},
+    'tempo': {'parse': _parse_generic},
+    'moneygram': {'parse': _parse_generic},
+    'settle_network': {'parse': _parse_generic},
+    'alchemy_pay': {'parse': _parse_generic, 'provider': 'alchemypay'},
+}
+
+ANCHOR = 'anchor'
+
+_verifiers = {}
+_lock = threading.Lock()
+
+
+class Verifier:
+    """Checks a provider's signature header with its secret keyed in once."""
+
+    def __init__(self, config):
+        self.header = config['header']
+        self.scheme = config['scheme']
+        self.encoding = config['encoding']
+        secret = config['secret'].encode()
+        self._secret = secret
+        self._mac = hmac.new(secret, digestmod=config['digest']) if secret else None
+
+    def verify(self, headers, body):
+        provided = headers.get(self.header)
+        if not self._secret or not provided:
+            return False
+        if self.scheme == 'token':
+            return hmac.compare_digest(provided.encode(), self._secret)
+        # Accept both a bare signature and a "sha256=<signature>" style one.
+        provided = provided.rpartition('=')[2] if self.encoding == 'hex' else provided
+        try:
+            signature = bytes.fromhex(provided) if self.encoding == 'hex' else base64.b64decode(provided)
+        except (ValueError, binascii.Error):
+            return False
+        mac = self._mac.copy()
+        mac.update(body)
+        return hmac.compare_digest(mac.digest(), signature)
+
+
+def provider_config(provider):
+    return {**DEFAULTS, **PROVIDERS.get(provider, {}), **getattr(settings, 'WEBHOOKS', {}).get(provider, {})}
+
+
+def verifier_for(provider):
+    verifier = _verifiers.get(provider)
+    if verifier is None:
+        with _lock:
+            verifier = _verifiers.get(provider)
+            if verifier is None:
+                verifier = _verifiers[provider] = Verifier(provider_config(provider))
+    return verifier
+
+
+_seen = None
+
+
+def seen_events():
+    """LRU of ``(provider, event_id)`` pairs known to be applied."""
+    global _seen
+    if _seen is None:
+        with _lock:
+            if _seen is None:
+                _seen = LRUCache(getattr(settings, 'WEBHOOK_DEDUPE_LRU_SIZE', 100000))
+    return _seen
+
+
+def handle(provider, headers, body):
+    """
+    Process one webhook delivery; returns ``(status_code, response_body)``.
+
+    Duplicates are acknowledged with 200 so the provider stops retrying.
+    An event for a transaction we do not know (yet) gets 404 and is not
+    recorded, so the provider's retry is processed normally. A final status
+    for the wrong amount or currency gets 422 and is not applied.
+    """
+    try:
+        event = _verified_event(provider, headers, body)
+    except WebhookError as e:
+        return e.status_code, {'error': str(e)}
+
+    seen = seen_events()
+    key = (provider, event.event_id)
+    if key in seen:
+        return 200, {'status': 'duplicate'}
+
+    row = (Transaction.objects
+           .filter(external_transaction_id=event.external_transaction_id,
+                   provider=provider_config(provider).get('provider', provider))
+           .values_list('pk', 'external_transaction_id', 'amount').first())
+    if row is None:
+        logger.warning(f"{provider} webhook {event.event_id} for unknown transaction "
+                       f"{event.external_transaction_id}")
+        return 404, {'error': 'Transaction not found.'}
+    pk = row[0]
+    if event.status is not None:
+        expected = expected_amounts([row])[pk]
+        if event.amount != expected or event.currency not in CURRENCIES:
+            logger.error(f"{provider} webhook {event.event_id} reports {event.amount} {event.currency} "
+                         f"for transaction {pk}, expected {expected} USD; not applying it")
+            return 422, {'error': 'Amount or currency does not match the transaction.'}
+
+    try:
+        with db_transaction.atomic():
+            WebhookEvent.objects.create(provider=provider, event_id=event.event_id,
+                                        external_transaction_id=event.external_transaction_id, status=event.status)
+            if event.status is not None:
+                settle_transactions({pk: event.status})
+    except IntegrityError:
+        seen.set(key, True)
+        return 200, {'status': 'duplicate'}
+    seen.set(key, True)
+    return 200, {'status': 'processed'}
+
+
+def _verified_event(provider, headers, body):
+    if provider not in PROVIDERS:
+        raise UnknownProvider(f"Unknown provider: {provider}")
+    if not verifier_for(provider).verify(headers, body):
+        raise InvalidSignature("Invalid signature.")
+    try:
+        return provider_config(provider)['parse'](json.loads(body))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise WebhookError("Malformed payload.")
+
+
+def reset():
+    global _seen
+    with _lock:
+        _verifiers.clear()
+        _seen = None
+
+
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('WEBHOOKS', 'WEBHOOK_DEDUPE_LRU_SIZE'):
+        reset()
+
+
+setting_changed.connect(_reset_on_setting_change)
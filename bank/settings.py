@@ -1,3 +1,4 @@
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -33,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -71,8 +73,9 @@ REST_FRAMEWORK = {
         'rest_framework.throttling.UserRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
-        'anon': '100/day',
-        'user': '1000/day'
+        'anon': os.environ.get('THROTTLE_ANON_RATE', '100/day'),
+        'user': os.environ.get('THROTTLE_USER_RATE', '1000/day'),
+        'callback': os.environ.get('THROTTLE_CALLBACK_RATE', '10000/hour')
     },
 
 }
@@ -112,6 +115,104 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+if os.environ.get('POSTGRES_DB'):
+    # e.g. to run `manage.py benchmark` against a local PostgreSQL
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'balances': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'balances',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+# Balances are invalidated through the cache, so every process that changes
+# them (web workers, outbox/inbox/reconcile/stream workers) must share it,
+# e.g. BALANCE_CACHE_URL=redis://localhost:6379/1 or memcached://localhost:11211
+BALANCE_CACHE_URL = os.environ.get('BALANCE_CACHE_URL', '')
+if BALANCE_CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES['balances'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': BALANCE_CACHE_URL,
+    }
+elif BALANCE_CACHE_URL.startswith('memcached://'):
+    CACHES['balances'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': BALANCE_CACHE_URL.removeprefix('memcached://'),
+    }
+
+# Balance cache: shared backend alias, in-process LRU size, entry TTL in seconds
+BALANCE_CACHE_ALIAS = 'balances'
+BALANCE_CACHE_LRU_SIZE = 10000
+BALANCE_CACHE_TIMEOUT = 300
+# A process-local balance cache is only correct when a single process serves
+# requests and runs the workers; outside DEBUG the system checks refuse it.
+BALANCE_CACHE_SINGLE_PROCESS = DEBUG
+
+BULK_TRANSFER_MAX_ITEMS = 10000
+
+# How long responses to requests sent with an Idempotency-Key are replayed
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# An unfinished request's reservation of its key is taken over after this long.
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(minutes=1)
+
+# Anchor callback inbox: failed batches are retried this many times, and callbacks
+# for transactions we do not know yet are retried for this long
+CALLBACK_MAX_ATTEMPTS = 5
+CALLBACK_UNMATCHED_TIMEOUT = timedelta(days=1)
+
+# Outbox dispatcher: attempts before failing a transaction, and backoff bounds in seconds
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 2.0
+OUTBOX_BACKOFF_MAX = 300.0
+OUTBOX_LEASE = timedelta(minutes=2)
+
+# Outbound HTTP per payment provider; see app/transport.py for the keys and defaults
+HTTP_TRANSPORT = {
+    'default': {'connect_timeout': 3.05, 'read_timeout': 10.0, 'retries': 2},
+    'stellar_anchor': {'pool_maxsize': 20, 'read_timeout': 20.0},
+    'horizon': {'pool_maxsize': 20, 'read_timeout': 30.0},
+    'flutterwave': {'pool_maxsize': 10},
+    'circle': {'pool_maxsize': 10},
+}
+
+# Bridge status checks: shared deadline in seconds for all legs, and worker threads
+BRIDGE_STATUS_TIMEOUT = 10.0
+BRIDGE_STATUS_WORKERS = 32
+
+# Per-provider circuit breakers; see app/circuit_breaker.py for the keys and defaults
+CIRCUIT_BREAKERS = {
+    'default': {'window': 50, 'min_calls': 10, 'failure_rate': 0.5, 'open_seconds': 30.0},
+}
+# Region -> providers in order of preference; overrides DEFAULT_ROUTES in app/payment_factory.py
+PAYMENT_ROUTES = {}
+
+# Payment providers constructed at startup instead of on first request, e.g. ['stellar', 'circle']
+PAYMENT_PROVIDERS_WARM_UP = []
+
+# Payout batcher: seconds to wait for more payouts before submitting a batch
+PAYOUT_BATCH_WINDOW = 0.5
+
+# reconcile_pending: status requests per second per provider. Nearly every
+# pending row is held by the Stellar anchor, so it gets enough to clear a
+# 100k-row backlog in about five minutes (at --concurrency 32 and ~100 ms per
+# call); Horizon ('stellar_payout') and the bridges get the default.
+RECONCILE_RATE_LIMITS = {'default': 50.0, 'stellar': 400.0}
+
+# SEP-10 tokens are refreshed this many seconds before their JWT expiry; at most
+# SEP10_TOKEN_CACHE_SIZE of them (one per user memo) are kept
+SEP10_REFRESH_MARGIN = 60
+SEP10_TOKEN_CACHE_SIZE = 10000
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -162,10 +263,48 @@ EMAIL_HOST_PASSWORD = 'your-email-password'
 
 CIRCLE_API_KEY = 'your_circle_api_key'
 CIRCLE_API_SECRET = 'your_circle_api_secret'
-CIRCLE_API_URL = 'https://api.circle.com/v1/'  # Update with the correct endpoint
+CIRCLE_API_URL = os.environ.get('CIRCLE_API_URL', 'https://api.circle.com/v1/')  # Update with the correct endpoint
+FLUTTERWAVE_API_URL = os.environ.get('FLUTTERWAVE_API_URL', 'https://api.flutterwave.com/v3')
 
 STELLAR_PLATFORM_SECRET = ''
-ANCHOR_URL = 'https://your-anchor-url.com'
+# Channel accounts for concurrent payouts from the platform account; see app/channels.py
+STELLAR_CHANNEL_SECRETS = []
+ANCHOR_URL = os.environ.get('ANCHOR_URL', 'https://your-anchor-url.com')
+# SEP-10 challenges must be signed by this key and name this home domain; by default
+# the key is read from the anchor's stellar.toml and the domain is ANCHOR_URL's host
+ANCHOR_SIGNING_KEY = os.environ.get('ANCHOR_SIGNING_KEY', '')
+ANCHOR_HOME_DOMAIN = os.environ.get('ANCHOR_HOME_DOMAIN', '')
+# Point ANCHOR_URL and STELLAR_HORIZON_URL at `manage.py mock_anchor` to run offline
+STELLAR_HORIZON_URL = os.environ.get('STELLAR_HORIZON_URL', 'https://horizon.stellar.org')
 USDC_ISSUER_PUBLIC_KEY = ''
 
+# Fees by region (UserProfile.region, with 'default' as the fallback) and
+# operation: tiers in ascending 'up_to' order, the last one open-ended, each
+# charging 'percent' of the amount plus 'fixed', clamped to 'minimum' and
+# 'maximum'. Amounts are strings so they stay exact; see app/fees.py.
+FEE_SCHEDULES = {
+    'default': {
+        'deposit': [{'up_to': None, 'percent': '1.0'}],
+        'withdrawal': [{'up_to': None, 'percent': '1.0'}],
+        'transfer': [{'up_to': None, 'percent': '1.0'}],
+    },
+}
+
+# Bearer token required to scrape /metrics; leave empty to serve it openly
+# (e.g. when only reachable from the internal network).
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Shared secrets for provider webhooks (/api/webhook/<provider>/); a provider
+# without one has all its webhooks rejected. Entries can also override the
+# signature 'header', 'digest', 'encoding' and 'scheme'; see app/webhooks.py.
+WEBHOOKS = {
+    'anchor': {'secret': os.environ.get('ANCHOR_WEBHOOK_SECRET', '')},
+    'flutterwave': {'secret': os.environ.get('FLUTTERWAVE_WEBHOOK_SECRET', '')},
+    'tempo': {'secret': os.environ.get('TEMPO_WEBHOOK_SECRET', '')},
+    'moneygram': {'secret': os.environ.get('MONEYGRAM_WEBHOOK_SECRET', '')},
+    'settle_network': {'secret': os.environ.get('SETTLE_NETWORK_WEBHOOK_SECRET', '')},
+    'alchemy_pay': {'secret': os.environ.get('ALCHEMY_PAY_WEBHOOK_SECRET', '')},
+}
+WEBHOOK_DEDUPE_LRU_SIZE = 100000
+
 AUTH_USER_MODEL = 'app.User'
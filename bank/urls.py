@@ -2,9 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 
 import app.urls
+from app.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(app.urls)),
     path('api/auth/', include('knox.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]